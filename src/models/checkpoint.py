@@ -0,0 +1,142 @@
+import logging
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+# completed bands of tasks are saved to redis ("redis") or to this directory, so
+# that a redelivered task resumes, empty disables checkpoints
+TILE_CHECKPOINT = os.getenv("TILE_CHECKPOINT", "")
+
+# checkpoints of abandoned tasks expire from redis after this number of seconds
+CHECKPOINT_TTL = 24 * 3600
+
+
+class DirCheckpoint:
+    """
+    Completed bands of task in local directory
+
+    Attributes:
+        path (str): directory of the task
+    """
+
+    def __init__(self, path: str, inference_id: str):
+        self.path = os.path.join(path, inference_id)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _read(self, name: str):
+        try:
+            with open(os.path.join(self.path, name), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _write(self, name: str, value):
+        # the directory is removed by clear
+        os.makedirs(self.path, exist_ok=True)
+        file = os.path.join(self.path, name)
+        with open(file + ".tmp", "wb") as f:
+            pickle.dump(value, f)
+        os.replace(file + ".tmp", file)
+
+    def load(self, index: int) -> np.ndarray:
+        """Output rows of band, None if the band is not completed"""
+        return self._read(f"{index}.pkl")
+
+    def save(self, index: int, rows: np.ndarray):
+        self._write(f"{index}.pkl", rows)
+
+    def load_state(self) -> dict:
+        """State carried between bands, None if there is no state"""
+        return self._read("state.pkl")
+
+    def save_state(self, state: dict):
+        self._write("state.pkl", state)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class RedisCheckpoint:
+    """
+    Completed bands of task in redis, keys expire after CHECKPOINT_TTL
+
+    Attributes:
+        redis_client (redis.Redis): redis client
+        inference_id (str): task id
+    """
+
+    def __init__(self, redis_client, inference_id: str):
+        self.redis_client = redis_client
+        self.inference_id = inference_id
+
+    def _key(self, name) -> str:
+        return f"{self.inference_id}:checkpoint:{name}"
+
+    def _read(self, name):
+        value = self.redis_client.get(self._key(name))
+        return None if value is None else pickle.loads(value)
+
+    def _write(self, name, value):
+        self.redis_client.set(self._key(name), pickle.dumps(value), ex=CHECKPOINT_TTL)
+        self.redis_client.sadd(self._key("keys"), self._key(name))
+        self.redis_client.expire(self._key("keys"), CHECKPOINT_TTL)
+
+    def load(self, index: int) -> np.ndarray:
+        """Output rows of band, None if the band is not completed"""
+        return self._read(index)
+
+    def save(self, index: int, rows: np.ndarray):
+        self._write(index, rows)
+
+    def load_state(self) -> dict:
+        """State carried between bands, None if there is no state"""
+        return self._read("state")
+
+    def save_state(self, state: dict):
+        self._write("state", state)
+
+    def clear(self):
+        keys = self.redis_client.smembers(self._key("keys"))
+        self.redis_client.delete(*keys, self._key("keys"))
+
+
+def resume(checkpoint, plan) -> dict:
+    """
+    State of checkpoint saved for the same plan. A checkpoint of another plan,
+    e.g. saved before the model config or tile size changed, is cleared, so that
+    its bands aren't mixed into the output.
+
+    Args:
+        checkpoint: DirCheckpoint or RedisCheckpoint
+        plan: fingerprint of model and tiling, compared with ==
+
+    Returns:
+        state with plan, and index and carry of blended bands if they were saved
+    """
+    state = checkpoint.load_state()
+    if state is not None and state.get("plan") == plan:
+        return state
+    if state is not None:
+        logging.warning("Checkpoint of another tiling plan is discarded")
+    checkpoint.clear()
+    state = {"plan": plan}
+    checkpoint.save_state(state)
+    return state
+
+
+def get_checkpoint(inference_id: str, redis_client=None):
+    """
+    Checkpoint of task configured by TILE_CHECKPOINT, None if checkpoints are
+    disabled
+    """
+    if not TILE_CHECKPOINT:
+        return None
+    if TILE_CHECKPOINT == "redis":
+        return RedisCheckpoint(redis_client, inference_id)
+    try:
+        return DirCheckpoint(TILE_CHECKPOINT, inference_id)
+    except OSError:
+        logging.warning("Checkpoint directory is not available", exc_info=True)
+        return None
@@ -0,0 +1,106 @@
+import logging
+import math
+import os
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from src.models.registry import BASE_PATH, ModelSpec
+from src.models.tiling import window_sides
+
+# inductor caches compiled kernels and graphs here, so that restarted workers
+# don't compile again
+COMPILE_CACHE_DIR = os.getenv(
+    "COMPILE_CACHE_DIR", os.path.join(BASE_PATH, "weights", "compile_cache")
+)
+
+# number of compiled sizes per side
+COMPILE_BUCKETS = int(os.getenv("COMPILE_BUCKETS", "2"))
+
+
+def bucket_sizes(spec: ModelSpec, count: int = COMPILE_BUCKETS) -> list:
+    """
+    Input sides the model is compiled for: count equal steps up to the largest
+    aligned tile window from model_configs.yaml, rounded up to the padding
+    multiple of the network
+
+    Args:
+        spec: model description
+        count: number of sizes
+
+    Returns:
+        sorted list of sizes, empty if the model is not tiled
+    """
+    if spec.tile_size <= 0:
+        return []
+    largest = window_sides(
+        spec.tile_size, spec.tile_pad, spec.tile_batch_size > 1, spec.tile_multiple
+    )[-1]
+    multiple = max(spec.pad_multiple, 8)
+    return sorted(
+        {
+            math.ceil(largest * step / count / multiple) * multiple
+            for step in range(1, count + 1)
+        }
+    )
+
+
+def enable_cache():
+    """
+    Persist inductor artifacts in COMPILE_CACHE_DIR
+    """
+    import torch._inductor.config
+
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+    torch._inductor.config.fx_graph_cache = True
+
+
+class CompiledModel(nn.Module):
+    """
+    Model compiled by torch.compile for a fixed set of input sizes
+
+    Inputs are padded up to the nearest bucket and the output is cropped, so that
+    edge tiles don't trigger recompilation. Inputs larger than the largest bucket
+    run eagerly. Padding replicates the border of the input, as SCUNet does itself.
+
+    Attributes:
+        model (nn.Module): eager model
+        scale (int): upscale factor
+        buckets (list): compiled input sides
+    """
+
+    def __init__(self, model: nn.Module, spec: ModelSpec, buckets: list):
+        super().__init__()
+        enable_cache()
+        self.model = model
+        self.scale = spec.scale
+        self.buckets = buckets
+        # not a submodule: weights of the compiled module are the same
+        self._compiled = torch.compile(model.forward, dynamic=False)
+        # every bucket shape is a separate graph of the same forward code
+        torch._dynamo.config.cache_size_limit += len(self.shapes)
+
+    @property
+    def shapes(self) -> list:
+        """Compiled input shapes (height, width)"""
+        return [(height, width) for height in self.buckets for width in self.buckets]
+
+    def bucket(self, size: int) -> int:
+        """Smallest bucket not smaller than size, None if there is no such bucket"""
+        return next((bucket for bucket in self.buckets if bucket >= size), None)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        _, _, h, w = x.shape
+        bucket_h, bucket_w = self.bucket(h), self.bucket(w)
+        if bucket_h is None or bucket_w is None:
+            return self.model(x)
+        x = F.pad(x, (0, bucket_w - w, 0, bucket_h - h), "replicate")
+        try:
+            output = self._compiled(x)
+        except Exception:
+            # e.g. no C++ compiler for cpu kernels
+            logging.warning("Compilation failed, using eager model", exc_info=True)
+            self._compiled = self.model
+            output = self.model(x)
+        return output[:, :, : h * self.scale, : w * self.scale]
@@ -0,0 +1,167 @@
+import io
+import os
+import pickle
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from src.models.image_enhance import Enhancer, image_to_tensor
+from src.models.registry import get_spec
+from src.models.stream_writer import PngWriter
+from src.models.tiling import split_bands
+
+# larger outputs are split into bands of tiles processed by all workers,
+# 0 disables splitting
+DISTRIBUTE_PIXELS = int(os.getenv("DISTRIBUTE_PIXELS", "0"))
+
+# parts of abandoned jobs expire from redis after this number of seconds
+PART_TTL = 3600
+
+# the gather claim of a crashed worker expires after this number of seconds,
+# longer than gathering the largest image takes
+GATHER_TTL = 300
+
+# workers waiting for the gather of another worker check it this often, seconds
+GATHER_POLL_INTERVAL = 1.0
+
+
+def should_distribute(model_name: str, img: Image) -> bool:
+    """
+    Output is larger than DISTRIBUTE_PIXELS and the model crops tiles, so that
+    bands don't depend on each other
+    """
+    spec = get_spec(model_name)
+    pixels = img.width * img.height * spec.scale**2
+    return (
+        0 < DISTRIBUTE_PIXELS < pixels
+        and spec.tile_size > 0
+        and spec.tile_merge == "crop"
+    )
+
+
+def plan_parts(model_name: str, img: Image) -> list:
+    """
+    Split image into parts for workers, one part per band of tiles
+
+    Every part carries the rows of pre-processed image under windows of its band
+    as uint8 (pre-processing only pads the image, so the values are exact) and
+    its tiles shifted to these rows, so that the result is the same as of
+    Enhancer.enhance_stream.
+
+    Returns:
+        list of dicts with index, tiles, rows (uint8 array (c, h, w)), start
+        (first output row of the band), height (number of output rows) and
+        width (output width)
+    """
+    enhancer = Enhancer(model_name=model_name)
+    enhancer.load_model()
+    img = img.convert("RGB")
+    output_height = img.height * enhancer.scale
+    output_width = img.width * enhancer.scale
+    enhancer.pre_process(image_to_tensor(img).unsqueeze(0))
+
+    parts = []
+    for tiles in split_bands(enhancer.plan_tiles()):
+        start = tiles[0].top * enhancer.scale
+        if start >= output_height:
+            # band of padding only
+            break
+        top = min(tile.window_top for tile in tiles)
+        bottom = max(tile.window_top + tile.window_height for tile in tiles)
+        rows = enhancer.img[0, :, top:bottom].mul(255).round().byte()
+        parts.append(
+            {
+                "index": len(parts),
+                "tiles": [tile.shifted(top) for tile in tiles],
+                "rows": rows.numpy(),
+                "start": start,
+                "height": min(tiles[0].height * enhancer.scale, output_height - start),
+                "width": output_width,
+            }
+        )
+    return parts
+
+
+@torch.no_grad()
+def process_part(model_name: str, part: dict) -> np.ndarray:
+    """
+    Process band of tiles
+
+    Returns:
+        uint8 array (rows, width, 3) of output image
+    """
+    enhancer = Enhancer(model_name=model_name, tile_merge="crop")
+    enhancer.load_model()
+    enhancer.img = torch.from_numpy(part["rows"]).float().div(255).unsqueeze(0)
+    band = enhancer.process_band(part["tiles"])
+    band = band[0, :, : part["height"], : part["width"]]
+    return band.clip(0, 1).mul(255).byte().permute(1, 2, 0).numpy()
+
+
+def part_key(inference_id: str, index: int) -> str:
+    return f"{inference_id}:part:{index}"
+
+
+def part_done(redis_client, inference_id: str, index: int) -> bool:
+    """Output of part is saved, e.g. before the worker processing it crashed"""
+    return bool(redis_client.sismember(f"{inference_id}:done", index))
+
+
+def save_part(redis_client, inference_id: str, index: int, rows: np.ndarray):
+    """Save output of part and mark it done"""
+    redis_client.set(part_key(inference_id, index), pickle.dumps(rows), ex=PART_TTL)
+    # a set, so that redelivered parts are counted once
+    redis_client.sadd(f"{inference_id}:done", index)
+    redis_client.expire(f"{inference_id}:done", PART_TTL)
+
+
+def gather_key(inference_id: str) -> str:
+    return f"{inference_id}:gather"
+
+
+def claim_gather(redis_client, inference_id: str, parts: int) -> bool:
+    """
+    All parts are done and this worker should gather them. While another worker
+    holds the claim, wait until it gathers the parts or its claim expires (e.g.
+    it crashed), then claim it again, so that a redelivered part of the crashed
+    worker gathers the result.
+    """
+    while redis_client.scard(f"{inference_id}:done") >= parts:
+        # workers finishing the last parts at the same time gather once
+        if redis_client.set(gather_key(inference_id), 1, nx=True, ex=GATHER_TTL):
+            return True
+        time.sleep(GATHER_POLL_INTERVAL)
+    return False
+
+
+def gather(redis_client, inference_id: str, parts: int, width: int, height: int):
+    """
+    Encode outputs of all parts into PNG, save it as the result of the task and
+    remove the parts in one transaction. The claim is released if gathering
+    fails, so that a waiting or redelivered part gathers again.
+
+    Returns:
+        PNG bytes
+    """
+    try:
+        file = io.BytesIO()
+        writer = PngWriter(file, width, height)
+        for index in range(parts):
+            rows = redis_client.get(part_key(inference_id, index))
+            writer.write(pickle.loads(rows))
+        writer.close()
+    except Exception:
+        redis_client.delete(gather_key(inference_id))
+        raise
+    result = file.getvalue()
+    pipeline = redis_client.pipeline()
+    pipeline.set(inference_id, pickle.dumps(result))
+    pipeline.delete(
+        *[part_key(inference_id, index) for index in range(parts)],
+        f"{inference_id}:done",
+        gather_key(inference_id),
+    )
+    pipeline.execute()
+    return result
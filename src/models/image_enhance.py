@@ -1,17 +1,61 @@
 import logging
-import math
 import os
+import queue
+import threading
+import time
 
+import numpy as np
 import torch
-from bestconfig import Config
 from PIL import Image
 from torch.nn import functional as F
-from torchvision.transforms import ToTensor
-from torchvision.transforms.functional import to_pil_image
 
-from src.models.mlwnet.MLWNet_arch import MLWNet_Local
-from src.models.real_esrgan.generator import RRDBNet
-from src.models.scunet.model import SCUNet
+from src.models.checkpoint import resume
+from src.models.model_cache import model_cache
+from src.models.precision import (
+    autocast,
+    input_dtype,
+    prepare_model,
+    resolve,
+    select_precision,
+)
+from src.models.quantization import load_quantized, load_quantized_state
+from src.models.registry import get_spec
+from src.models.tile_cache import tile_cache, tile_key, weights_fingerprint
+from src.models.tiling import BufferPool, is_flat, plan_tiles, split_bands
+from src.models.weights_io import load_state_dict, weights_dtype
+
+BACKENDS = ["torch", "onnxruntime", "compile"]
+
+# crop: every tile is cut from the middle of its window, blend: overlapping window
+# outputs are averaged with weights falling to the window sides
+TILE_MERGES = ["crop", "blend"]
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+
+# choose tile size from available memory and the memory profile written by
+# python -m src.models.receptive_field
+AUTO_TILE_SIZE = os.getenv("AUTO_TILE_SIZE", "0") == "1"
+
+# number of prepared and processed batches of tiles waiting in pipeline queues
+PIPELINE_DEPTH = 2
+
+
+def image_to_tensor(img: Image) -> torch.Tensor:
+    """
+    Convert RGB image to float tensor (c, h, w) in range [0, 1],
+    same as torchvision ToTensor without importing torchvision
+    """
+    return (
+        torch.from_numpy(np.array(img)).permute(2, 0, 1).contiguous().float().div(255)
+    )
+
+
+def tensor_to_image(tensor: torch.Tensor) -> Image:
+    """
+    Convert float tensor (c, h, w) in range [0, 1] to RGB image,
+    same as torchvision to_pil_image
+    """
+    return Image.fromarray(tensor.mul(255).byte().permute(1, 2, 0).numpy())
 
 
 class Enhancer:
@@ -19,11 +63,21 @@ class Enhancer:
     Load model and enhance image
 
     Attributes:
-        model_name (str): real_esrgan_x2, real_esrgan_x4, nafnet_realblur or nafnet_sidd
+        model_name (str): model name from model_configs.yaml
         tile_size (int): tile size for image splitting
         tile_pad (int): pad size for tile
         pre_pad (int): pad size for image
+        tile_batch_size (int): number of tiles in one forward
+        tile_merge (str): crop or blend, blending hides seams with smaller tile_pad
+        flat_threshold (float): near-uniform tiles skip the network, 0 disables
+            skipping, by default from model_configs.yaml
+        auto_tile_size (bool): if tile_size is not given, choose it from memory
+            available at load time, by default AUTO_TILE_SIZE environment variable
         device (str): device
+        precision (str): fp32, bf16, fp16, int8 or auto, by default from model_configs.yaml
+        backend (str): torch, onnxruntime (fp32 graph exported from torch model) or
+            compile (torch.compile for tile sizes bucketed to a fixed set),
+            by default INFERENCE_BACKEND environment variable
     """
 
     def __init__(
@@ -32,12 +86,26 @@ class Enhancer:
         tile_size: int = None,
         tile_pad: int = None,
         pre_pad: int = None,
+        tile_batch_size: int = None,
+        tile_merge: str = None,
+        flat_threshold: float = None,
+        auto_tile_size: bool = None,
         device: str = None,
+        precision: str = None,
+        backend: str = None,
     ):
         self.model_name = model_name
         self.tile_size = tile_size
         self.tile_pad = tile_pad
         self.pre_pad = pre_pad
+        self.tile_batch_size = tile_batch_size
+        self.tile_merge = tile_merge
+        self.flat_threshold = flat_threshold
+        self.flat_tiles = 0
+        self.use_tile_cache = False
+        self.auto_tile_size = (
+            AUTO_TILE_SIZE if auto_tile_size is None else auto_tile_size
+        )
         if device is None:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         else:
@@ -46,67 +114,124 @@ class Enhancer:
         self.scale = None
         self.mod_scale = None
         self.model = None
-        self.swin = False
+        self.tile_multiple = 1
+        self.precision = precision
+        self.backend = backend or INFERENCE_BACKEND
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {self.backend}")
 
     def load_model(self):
         """
-        For load model. Modify to add a new model.
+        Load model from the process-wide model cache or build it on miss.
+        Models are described in model_configs.yaml.
         """
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        config = Config("model_configs.yaml")
         logging.info(self.model_name)
-        if self.model_name == "real_esrgan_x2":
-            self.scale = config[self.model_name]["scale"]
-            self.model = RRDBNet(**config[self.model_name]["params"])
-            self.model.load_state_dict(
-                torch.load(
-                    os.path.join(base_path, config[self.model_name]["weights_path"]),
-                    weights_only=True,
-                )["params_ema"]
-            )
-        elif self.model_name == "real_esrgan_x4":
-            self.scale = config[self.model_name]["scale"]
-            self.model = RRDBNet(**config[self.model_name]["params"])
-            self.model.load_state_dict(
-                torch.load(
-                    os.path.join(base_path, config[self.model_name]["weights_path"]),
-                    weights_only=True,
-                )["params_ema"]
-            )
-        elif self.model_name == "mlwnet":
-            self.scale = config[self.model_name]["scale"]
-            self.model = MLWNet_Local(**config[self.model_name]["params"])
-            self.model.load_state_dict(
-                torch.load(
-                    os.path.join(base_path, config[self.model_name]["weights_path"]),
-                    weights_only=True,
-                )["params"]
-            )
-        elif self.model_name == "scunet":
-            self.scale = config[self.model_name]["scale"]
-            params = config[self.model_name]["params"]
-            self.model = SCUNet(**params)
-            self.model.load_state_dict(
-                torch.load(
-                    os.path.join(base_path, config[self.model_name]["weights_path"]),
-                    weights_only=True,
-                ),
-                strict=True,
-            )
-        else:
-            raise ValueError("Model not found")
+        spec = get_spec(self.model_name)
+        self.scale = spec.scale
+        self.tile_multiple = spec.tile_multiple
 
-        if self.tile_size is None:
-            self.tile_size = config[self.model_name]["tile_size"]
+        precision = resolve(self.precision or spec.precision, self.device)
+        if self.backend == "onnxruntime":
+            precision = "fp32"
+        if precision == "auto":
+            precision = select_precision(
+                self.model_name,
+                self.device,
+                lambda candidate: self.get_model(spec, candidate),
+            )
+            # keep only the chosen model in cache
+            for key in model_cache.keys():
+                if (
+                    key[:2] == (self.model_name, str(self.device))
+                    and key[2] != precision
+                    and key[3] == self.backend
+                ):
+                    model_cache.remove(key)
+        self.precision = precision
+        self.model = self.get_model(spec, precision)
 
         if self.tile_pad is None:
-            self.tile_pad = config[self.model_name]["tile_pad"]
+            self.tile_pad = spec.tile_pad
 
         if self.pre_pad is None:
-            self.pre_pad = config[self.model_name]["pre_pad"]
+            self.pre_pad = spec.pre_pad
+
+        if self.tile_batch_size is None:
+            self.tile_batch_size = spec.tile_batch_size
+
+        if self.tile_size is None:
+            self.tile_size = spec.tile_size
+            if self.auto_tile_size and self.tile_size > 0:
+                self.tile_size = self.choose_tile_size(spec)
+
+        if self.tile_merge is None:
+            self.tile_merge = spec.tile_merge
+        if self.tile_merge not in TILE_MERGES:
+            raise ValueError(f"Unknown tile merge {self.tile_merge}")
 
-        self.model = self.model.to(self.device)
-        self.model.eval()
+        if self.flat_threshold is None:
+            self.flat_threshold = spec.flat_threshold
+
+        self.use_tile_cache = tile_cache.enabled and spec.tile_cache
+
+    def choose_tile_size(self, spec) -> int:
+        """
+        Tile size fitting into available memory, tile_size from model_configs.yaml
+        if the model is not profiled. The tile is at least its pad and the tile
+        multiple of the model (8 at least), so that tiling is never disabled by
+        tile size 0.
+        """
+        from src.models.receptive_field import auto_tile_size
+
+        tile_size = auto_tile_size(
+            spec, self.precision, self.device, self.tile_pad, self.tile_batch_size
+        )
+        if tile_size is None:
+            return spec.tile_size
+        # tile smaller than its pad wastes most of the compute, such tiles are
+        # better left to the memory error handling
+        minimum = max(self.tile_pad, spec.tile_multiple, 8)
+        if tile_size < minimum:
+            logging.warning(
+                f"Auto tile size {tile_size} for {self.model_name} doesn't fit "
+                f"into free memory, using {minimum}"
+            )
+            return minimum
+        logging.info(f"Auto tile size for {self.model_name}: {tile_size}")
+        return tile_size
+
+    def get_model(self, spec, precision):
+        key = (self.model_name, str(self.device), precision, self.backend)
+        return model_cache.get(key, lambda: self.build_model(spec, precision))
+
+    def build_model(self, spec, precision):
+        """
+        Build model, load its weights and convert them for precision
+        """
+        # taken before the weights are read, keys tile outputs of this model
+        fingerprint = weights_fingerprint(spec, precision)
+        model = spec.load_class()(**spec.params)
+        state_dict = load_state_dict(spec, weights_dtype(precision))
+        # assign keeps memory-mapped tensors instead of copying them into the model
+        model.load_state_dict(state_dict, strict=True, assign=True)
+        quantized = load_quantized_state(spec) if precision == "int8" else None
+        if quantized is not None:
+            # convolutions calibrated by python -m src.models.quantization
+            model = load_quantized(model, quantized)
+        else:
+            model = prepare_model(model, precision)
+        model = model.to(self.device)
+        model.eval()
+        if self.backend == "onnxruntime":
+            from src.models.onnx_backend import OrtModel
+
+            model = OrtModel(model, spec, self.device)
+        elif self.backend == "compile":
+            from src.models.compile_backend import CompiledModel, bucket_sizes
+
+            model = CompiledModel(model, spec, bucket_sizes(spec))
+        model.weights_fingerprint = fingerprint
+        return model
 
     def pre_process(self, img):
         """
@@ -132,10 +257,26 @@ class Enhancer:
                 self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), "reflect"
             )
 
+    def inference(self, img):
+        """
+        Run model on image or tile and return result on cpu
+        """
+        with autocast(self.precision, self.device):
+            output = self.model(img.to(self.device, dtype=input_dtype(self.precision)))
+        return output.float().cpu()
+
+    def shortcut(self, img: torch.Tensor) -> torch.Tensor:
+        """
+        Fast path for near-uniform tiles: bicubic resize for upscale, copy for
+        deblur and denoise
+        """
+        if self.scale == 1:
+            return img.clone()
+        return F.interpolate(img, scale_factor=self.scale, mode="bicubic")
+
     def process(self):
         # model inference
-        with torch.autocast(device_type=self.device.type, dtype=torch.bfloat16):
-            self.output = self.model(self.img.to(self.device)).cpu()
+        self.output = self.inference(self.img)
 
     def tile_process(self):
         """It will first crop input images to tiles, and then process each tile.
@@ -150,77 +291,225 @@ class Enhancer:
 
         # start with black image
         self.output = self.img.new_zeros(output_shape)
-        tiles_x = math.ceil(width / self.tile_size)
-        tiles_y = math.ceil(height / self.tile_size)
-
-        # loop over all tiles
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * self.tile_size
-                ofs_y = y * self.tile_size
-                # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.tile_size, width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.tile_size, height)
-
-                # input tile area on total image with padding
-                input_start_x_pad = max(input_start_x - self.tile_pad, 0)
-                input_end_x_pad = min(input_end_x + self.tile_pad, width)
-                input_start_y_pad = max(input_start_y - self.tile_pad, 0)
-                input_end_y_pad = min(input_end_y + self.tile_pad, height)
-
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[
-                    :,
-                    :,
-                    input_start_y_pad:input_end_y_pad,
-                    input_start_x_pad:input_end_x_pad,
+        if self.tile_merge == "blend":
+            weights = self.img.new_zeros((1, 1, output_height, output_width))
+            self.process_tiles(self.plan_tiles(), self.output, weights=weights)
+            # pixels of failed tiles stay black
+            self.output /= weights.clamp_(min=1e-8)
+        else:
+            self.process_tiles(self.plan_tiles(), self.output)
+
+    def plan_tiles(self) -> list:
+        """
+        Tiles of pre-processed image. Windows are aligned to the padding multiple
+        of the network, so that it doesn't pad them with replicated pixels and its
+        downsampling keeps the phase of the whole image.
+        """
+        _, _, height, width = self.img.shape
+        return plan_tiles(
+            height,
+            width,
+            self.tile_size,
+            self.tile_pad,
+            uniform=self.tile_batch_size > 1,
+            multiple=self.tile_multiple,
+        )
+
+    def process_tiles(
+        self,
+        tiles: list,
+        output: torch.Tensor,
+        top: int = 0,
+        weights: torch.Tensor = None,
+    ):
+        """
+        Process tiles in batches of tile_batch_size and put them into output
+
+        Tiles with near-uniform windows (is_flat with flat_threshold) are batched
+        separately and take the shortcut instead of the model, their number is
+        saved in self.flat_tiles.
+
+        If the tile cache is enabled, batches whose windows are all cached skip
+        the model, outputs of other batches are cached.
+
+        If weights are given, whole window outputs are blended: they are added to
+        output multiplied by feathered weights (Tile.weights), which are summed in
+        weights, so that output divided by weights is the blended image.
+
+        Tiles are cut into reused buffers and written to the output image by helper
+        threads, so that this thread only runs the model. Busy time of every stage
+        and time the model waited for tiles are saved in self.timings.
+
+        Args:
+            tiles: tiles of pre-processed image
+            output: output image or its band
+            top: first input row of the band
+            weights: sum of blending weights (1, 1, height, width) of output
+        """
+        batch, channel, height, width = self.img.shape
+        flat = set()
+        if self.flat_threshold > 0:
+            flat = {
+                tile.index
+                for tile in tiles
+                if is_flat(self.img[(..., *tile.window())], self.flat_threshold)
+            }
+        groups = []
+        for part in (
+            [tile for tile in tiles if tile.index not in flat],
+            [tile for tile in tiles if tile.index in flat],
+        ):
+            # aligned windows of a uniform plan differ in size by less than
+            # tile_multiple, only windows of the same size are batched
+            shapes = {}
+            for tile in part:
+                shapes.setdefault((tile.window_height, tile.window_width), []).append(
+                    tile
+                )
+            for same in shapes.values():
+                groups += [
+                    same[start : start + self.tile_batch_size]
+                    for start in range(0, len(same), self.tile_batch_size)
                 ]
+        self.flat_tiles = len(flat)
+
+        pool = BufferPool(pin_memory=self.device.type == "cuda")
+        inputs = queue.Queue(maxsize=PIPELINE_DEPTH)
+        outputs = queue.Queue(maxsize=PIPELINE_DEPTH)
+        self.timings = dict.fromkeys(["prepare", "inference", "write", "wait"], 0.0)
+        errors = []
+        stop = threading.Event()
+
+        def prepare():
+            try:
+                for group in groups:
+                    if stop.is_set():
+                        break
+                    start = time.perf_counter()
+                    tile = group[0]
+                    input_tiles = pool.get(
+                        (
+                            len(group) * batch,
+                            channel,
+                            tile.window_height,
+                            tile.window_width,
+                        )
+                    )
+                    for index, tile in enumerate(group):
+                        input_tiles[index * batch : (index + 1) * batch].copy_(
+                            self.img[(..., *tile.window())]
+                        )
+                    self.timings["prepare"] += time.perf_counter() - start
+                    keys = []
+                    if self.use_tile_cache and tile.index not in flat:
+                        keys = [
+                            tile_key(
+                                self.model_name,
+                                self.precision,
+                                self.backend,
+                                self.model.weights_fingerprint,
+                                input_tiles[index * batch : (index + 1) * batch],
+                            )
+                            for index in range(len(group))
+                        ]
+                    cached = [tile_cache.get(key) for key in keys]
+                    inputs.put((group, input_tiles, keys, cached))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                inputs.put(None)
 
-                # upscale tile
+        def window_weights(tile):
+            # weights depend only on the window and its sides on the image border
+            key = (
+                tile.window_height,
+                tile.window_width,
+                tile.window_top > 0,
+                tile.window_left > 0,
+                tile.window_top + tile.window_height < height,
+                tile.window_left + tile.window_width < width,
+            )
+            if key not in cache:
+                cache[key] = tile.weights(self.scale, self.tile_pad, height, width)
+            return cache[key]
+
+        cache = {}
+
+        def write():
+            while (item := outputs.get()) is not None:
+                if errors:
+                    continue
+                start = time.perf_counter()
+                group, output_tiles = item
+                try:
+                    for tile, output_tile in zip(group, output_tiles.split(batch)):
+                        if weights is None:
+                            output[(..., *tile.area(self.scale, top))] = output_tile[
+                                (..., *tile.crop(self.scale))
+                            ]
+                        else:
+                            area = (..., *tile.window_area(self.scale, top))
+                            weight = window_weights(tile)
+                            output[area] += output_tile * weight
+                            weights[area] += weight
+                except Exception as error:
+                    errors.append(error)
+                self.timings["write"] += time.perf_counter() - start
+
+        threads = [
+            threading.Thread(target=prepare, daemon=True),
+            threading.Thread(target=write, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        item = ()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = inputs.get()
+                self.timings["wait"] += time.perf_counter() - start
+                if item is None:
+                    break
+                group, input_tiles, keys, cached = item
+
+                # upscale tiles
+                start = time.perf_counter()
                 try:
-                    with torch.autocast(
-                        device_type=self.device.type, dtype=torch.bfloat16
-                    ):
-                        if self.swin:
-                            input_tile = self.pad_tile(input_tile)
-                        output_tile = self.model(input_tile.to(self.device)).cpu()
+                    if group[0].index in flat:
+                        output_tiles = self.shortcut(input_tiles)
+                    elif cached and None not in cached:
+                        output_tiles = torch.cat(cached)
+                    else:
+                        output_tiles = self.inference(input_tiles)
+                        for key, output_tile in zip(keys, output_tiles.split(batch)):
+                            # views would keep the whole batch in the cache
+                            tile_cache.put(key, output_tile.clone())
                 except RuntimeError as error:
                     logging.error(error)
-                logging.info(f"\tTile {tile_idx}/{tiles_x * tiles_y}")
-
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
-
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
-
-                # put tile into output image
-                self.output[
-                    :, :, output_start_y:output_end_y, output_start_x:output_end_x
-                ] = output_tile[
-                    :,
-                    :,
-                    output_start_y_tile:output_end_y_tile,
-                    output_start_x_tile:output_end_x_tile,
-                ]
-
-    def pad_tile(self, tile):
-        height, width = tile.shape[2:]
-        pad_height = (self.window_size - (height % self.window_size)) % self.window_size
-        pad_width = (self.window_size - (width % self.window_size)) % self.window_size
-        return F.pad(tile, (0, pad_width, 0, pad_height), "reflect")
+                    continue
+                finally:
+                    pool.release(input_tiles)
+                self.timings["inference"] += time.perf_counter() - start
+                logging.info(f"\tTile {group[-1].index}/{len(tiles)}")
+                outputs.put((group, output_tiles))
+        finally:
+            stop.set()
+            while item is not None:
+                item = inputs.get()
+            outputs.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        if flat:
+            logging.info(f"Skipped {len(flat)}/{len(tiles)} flat tiles")
+        logging.info(
+            "Tile timings: "
+            + ", ".join(
+                f"{stage} {value:.2f} s" for stage, value in self.timings.items()
+            )
+        )
 
     def post_process(self):
         # remove extra pad
@@ -250,12 +539,173 @@ class Enhancer:
         except Exception:
             logging.error("LoadModelError", exc_info=True)
         img = img.convert("RGB")
-        img = ToTensor()(img).unsqueeze(0)
+        img = image_to_tensor(img).unsqueeze(0)
         self.pre_process(img)
         if self.tile_size > 0:
             self.tile_process()
         else:
             self.process()
         output_img = self.post_process()
-        output_img = to_pil_image(output_img.squeeze(0).clamp(0, 1))
+        output_img = tensor_to_image(output_img.squeeze(0).clamp(0, 1))
         return output_img
+
+    @torch.no_grad()
+    def enhance_stream(self, img: Image, writer, checkpoint=None):
+        """
+        Enhance image band by band: every row of tiles is converted to uint8 and
+        written as soon as it is processed, so that memory is bounded by one band
+        of output instead of the whole image
+
+        Args:
+            img: input image
+            writer: object with write(rows) method for uint8 arrays (rows, width, 3),
+                e.g. PngWriter or MemmapWriter
+            checkpoint: completed bands are saved to it and bands found in it are
+                not processed again, e.g. DirCheckpoint or RedisCheckpoint. It is
+                cleared if it was saved with another plan_fingerprint.
+        """
+        self.load_model()
+        img = img.convert("RGB")
+        output_height = img.height * self.scale
+        output_width = img.width * self.scale
+        self.pre_process(image_to_tensor(img).unsqueeze(0))
+
+        def to_rows(band: torch.Tensor, start: int) -> np.ndarray:
+            # remove pre pad and mod pad
+            band = band[0, :, : max(output_height - start, 0), :output_width]
+            return band.clip(0, 1).mul(255).byte().permute(1, 2, 0).numpy()
+
+        def write(rows: np.ndarray):
+            if len(rows):
+                writer.write(rows)
+
+        if self.tile_size <= 0:
+            self.process()
+            write(to_rows(self.output, 0))
+            return
+
+        bands = split_bands(self.plan_tiles())
+        if checkpoint:
+            resume(checkpoint, self.plan_fingerprint(bands))
+        if self.tile_merge == "blend":
+            self.blend_bands(bands, to_rows, write, checkpoint)
+            return
+        for index, tiles in enumerate(bands):
+            top = tiles[0].top
+            if top * self.scale >= output_height:
+                # band of padding only
+                break
+            rows = checkpoint.load(index) if checkpoint else None
+            if rows is None:
+                rows = to_rows(self.process_band(tiles), top * self.scale)
+                if checkpoint:
+                    checkpoint.save(index, rows)
+            else:
+                logging.info(f"Band {index + 1}/{len(bands)} restored from checkpoint")
+            write(rows)
+
+    def plan_fingerprint(self, bands: list) -> tuple:
+        """
+        Model, precision, tiling and windows of every band, everything saved bands
+        depend on. Checkpoints saved with another fingerprint are discarded.
+        """
+        return (
+            self.model_name,
+            self.scale,
+            self.precision,
+            self.backend,
+            self.tile_size,
+            self.tile_pad,
+            self.tile_merge,
+            self.flat_threshold,
+            tuple(self.img.shape),
+            tuple(
+                tuple(
+                    (
+                        tile.top,
+                        tile.height,
+                        tile.window_top,
+                        tile.window_left,
+                        tile.window_height,
+                        tile.window_width,
+                    )
+                    for tile in tiles
+                )
+                for tiles in bands
+            ),
+        )
+
+    def process_band(self, tiles: list) -> torch.Tensor:
+        """
+        Output of a row of tiles of pre-processed image, tiles are cropped from
+        their windows
+
+        Args:
+            tiles: tiles with the same top
+
+        Returns:
+            tensor (b, c, tile height * scale, width * scale)
+        """
+        batch, channel, _, width = self.img.shape
+        band = self.img.new_zeros(
+            (batch, channel, tiles[0].height * self.scale, width * self.scale)
+        )
+        self.process_tiles(tiles, band, tiles[0].top)
+        return band
+
+    def blend_bands(self, bands: list, to_rows, write, checkpoint=None):
+        """
+        Blend rows of tiles and write them as soon as they are final: windows of a
+        row overlap the next row, so the overlapping output rows are carried over
+        to the next band
+
+        Args:
+            bands: lists of tiles, row by row
+            to_rows: function converting band of output starting at given output
+                row to uint8 rows
+            write: function writing uint8 rows
+            checkpoint: completed bands and the carried rows of the last one are
+                saved to it, processing resumes after the last saved band
+        """
+        batch, channel, _, width = self.img.shape
+        carry = None
+        state = (checkpoint.load_state() or {}) if checkpoint else {}
+        last = state.get("index", -1)
+        for index, tiles in enumerate(bands):
+            if index <= last:
+                write(checkpoint.load(index))
+                carry = state["carry"]
+                continue
+            band_top = min(tile.window_top for tile in tiles)
+            band_bottom = max(tile.window_top + tile.window_height for tile in tiles)
+            band_height = (band_bottom - band_top) * self.scale
+            band = self.img.new_zeros((batch, channel, band_height, width * self.scale))
+            weights = self.img.new_zeros((1, 1, band_height, width * self.scale))
+            if carry is not None:
+                carry_band, carry_weights = carry
+                band[:, :, : len(carry_weights[0, 0])] = carry_band
+                weights[:, :, : len(carry_weights[0, 0])] = carry_weights
+            self.process_tiles(tiles, band, band_top, weights)
+
+            # rows not covered by windows of the next row are final
+            if index + 1 < len(bands):
+                next_top = min(tile.window_top for tile in bands[index + 1])
+            else:
+                next_top = band_bottom
+            final = (next_top - band_top) * self.scale
+            rows = to_rows(
+                band[:, :, :final] / weights[:, :, :final].clamp(min=1e-8),
+                band_top * self.scale,
+            )
+            write(rows)
+            carry = band[:, :, final:], weights[:, :, final:]
+            if checkpoint:
+                # rows are saved first, a band without state is processed again
+                checkpoint.save(index, rows)
+                checkpoint.save_state(
+                    {
+                        **state,
+                        "index": index,
+                        "carry": tuple(part.clone() for part in carry),
+                    }
+                )
@@ -0,0 +1,67 @@
+# python -m src.models.import_benchmark
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = [
+    "torch",
+    "src.models.image_enhance",
+    "src.models.real_esrgan.generator",
+    "src.models.scunet.model",
+    "src.models.mlwnet.MLWNet_arch",
+]
+
+# packages that should not be imported by the worker unless a model needs them
+TRACKED_PACKAGES = ["ptflops", "torchinfo", "timm", "pywt", "einops", "numpy"]
+
+CODE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "modules": list(sys.modules)}}))
+"""
+
+
+def import_time(module: str, repeat: int = 3) -> dict:
+    """
+    Measure import time of module in a fresh interpreter
+
+    Args:
+        module: module name
+        repeat: number of runs, the best one is reported
+
+    Returns:
+        import time in seconds and tracked packages that were imported
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", CODE.format(module=module)],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(data["time"])
+    packages = [p for p in TRACKED_PACKAGES if p in data["modules"]]
+    return {"time": min(times), "packages": packages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        result = import_time(module, args.repeat)
+        print(
+            "{:<40}  {:>6.3f} s  {}".format(
+                module, result["time"], ", ".join(result["packages"])
+            )
+        )
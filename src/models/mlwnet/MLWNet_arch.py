@@ -8,8 +8,6 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from ptflops import get_model_complexity_info
-from torchinfo import summary
 
 from src.models.mlwnet.local_arch import Local_Base
 from src.models.mlwnet.wavelet_block import LWN
@@ -54,7 +52,15 @@ class LayerNorm2d(nn.Module):
         self.eps = eps
 
     def forward(self, x):
-        return LayerNormFunction.apply(x, self.weight, self.bias, self.eps)
+        if self.training:
+            return LayerNormFunction.apply(x, self.weight, self.bias, self.eps)
+        # same as LayerNormFunction.forward, autograd functions are not traced by
+        # onnx export and torch.compile
+        C = x.size(1)
+        mu = x.mean(1, keepdim=True)
+        var = (x - mu).pow(2).mean(1, keepdim=True)
+        y = (x - mu) / (var + self.eps).sqrt()
+        return self.weight.view(1, C, 1, 1) * y + self.bias.view(1, C, 1, 1)
 
 
 class WaveletBlock(nn.Module):
@@ -497,6 +503,9 @@ class MLWNet_Local(Local_Base, MLWNet):
 
 
 if __name__ == "__main__":
+    from ptflops import get_model_complexity_info
+    from torchinfo import summary
+
     model = MLWNet_Local(dim=32)
     summary(model, input_size=(1, 3, 64, 64))
     with torch.cuda.device(0):
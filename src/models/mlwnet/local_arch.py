@@ -43,6 +43,9 @@ class AvgPool2d(nn.Module):
             self.max_r1 = max(1, self.rs[0] * x.shape[2] // train_size[-2])
             self.max_r2 = max(1, self.rs[0] * x.shape[3] // train_size[-1])
 
+        if torch.onnx.is_in_onnx_export():
+            return self.export_forward(x)
+
         if self.kernel_size[0] >= x.size(-2) and self.kernel_size[1] >= x.size(-1):
             return F.adaptive_avg_pool2d(x, 1)
 
@@ -91,6 +94,23 @@ class AvgPool2d(nn.Module):
 
         return out
 
+    def export_forward(self, x):
+        """
+        Same as forward without branches on input size, so that the exported graph
+        accepts any input size. The input must not be smaller than kernel_size.
+        """
+        k1, k2 = self.kernel_size
+        s = x.cumsum(dim=-1).cumsum(dim=-2)
+        s = torch.nn.functional.pad(s, (1, 0, 1, 0))
+        out = (
+            s[:, :, k1:, k2:]
+            + s[:, :, :-k1, :-k2]
+            - s[:, :, :-k1, k2:]
+            - s[:, :, k1:, :-k2]
+        ) / (k1 * k2)
+        pad2d = ((k2 - 1) // 2, k2 // 2, (k1 - 1) // 2, k1 // 2)
+        return torch.nn.functional.pad(out, pad2d, mode="replicate")
+
 
 def replace_layers(model, base_size, train_size, fast_imp, **kwargs):
     for n, m in model.named_children():
@@ -184,6 +184,12 @@ class ShuffleBlock(nn.Module):
 # global count
 # count = 1
 class LWN(nn.Module):
+    # inference mode: wavelet kernels are precomputed once and folded into conv1 and
+    # conv3, filters of length 2 (haar) run as pixel unshuffle and pixel shuffle;
+    # int8 convolutions (quantization) have no float weights to fold and run the
+    # learned-filter path
+    frozen = True
+
     def __init__(
         self,
         dim,
@@ -250,8 +256,19 @@ class LWN(nn.Module):
                 nn.Conv2d(dim, dim, 1, padding=0, stride=1, groups=1, bias=True),
             )
             self.shuffle = ShuffleBlock(2)
+        self._frozen_weights = None
+        self._frozen_version = None
 
     def forward(self, x):
+        if (
+            self.frozen
+            and not self.training
+            and not torch.is_grad_enabled()
+            and not torch.compiler.is_compiling()
+            and type(self.conv1) is nn.Conv2d
+            and type(self.conv3) is nn.Conv2d
+        ):
+            return self.frozen_forward(x)
         _, _, H, W = x.shape
         ya, (yh, yv, yd) = self.wavedec(x)
         dec_x = torch.cat([ya, yh, yv, yd], dim=1)
@@ -261,6 +278,10 @@ class LWN(nn.Module):
         x = self.conv3(x)
         ya, yh, yv, yd = torch.chunk(x, 4, dim=1)
         y = self.waverec([ya, (yh, yv, yd)], None)
+        return self.attend(y, yh, yv)
+
+    def attend(self, y, yh, yv):
+        """Spatial and channel attention of detail components"""
         if self.use_sa:
             sa_yh = self.sa_h(yh)
             sa_yv = self.sa_v(yv)
@@ -276,6 +297,94 @@ class LWN(nn.Module):
             y = y * ca
         return y
 
+    @torch.no_grad()
+    def frozen_weights(self):
+        """Wavelet kernels and conv1, conv3 weights for inference, computed once
+        and recomputed only if the parameters change.
+
+        conv1 takes the DWT components in channel-major order (c f) as they come
+        out of the grouped convolution, conv3 gives them in the same order for
+        the transposed convolution. For filters of length 2 the DWT is a 4x4
+        matrix on pixels k of 2x2 blocks, it is also folded into conv1 and conv3
+        for pixel unshuffled input and pixel shuffled output.
+        """
+        params = [
+            self.dec_lo,
+            self.dec_hi,
+            self.rec_lo,
+            self.rec_hi,
+            self.conv1.weight,
+            self.conv3.weight,
+            self.conv3.bias,
+        ]
+        version = [(p._version, p.data_ptr(), p.dtype, p.device) for p in params]
+        if self._frozen_version == version:
+            return self._frozen_weights
+
+        c = self.dim
+        dwt_kernel = construct_2d_filt(lo=self.dec_lo, hi=self.dec_hi)
+        idwt_kernel = construct_2d_filt(lo=self.rec_lo, hi=self.rec_hi)
+        conv1 = rearrange(self.conv1.weight, "o (f c) 1 1 -> o c f", f=4)
+        conv3 = rearrange(self.conv3.weight, "(f c) i 1 1 -> c f i", f=4)
+        bias3 = rearrange(self.conv3.bias, "(f c) -> c f", f=4)
+        weights = {
+            "dwt": dwt_kernel.repeat(c, 1, 1).unsqueeze(1),
+            "idwt": idwt_kernel.repeat(c, 1, 1).unsqueeze(1),
+            "conv1": conv1.reshape(c * 6, c * 4, 1, 1),
+            "conv3": conv3.reshape(c * 4, c * 6, 1, 1),
+            "bias3": bias3.reshape(c * 4),
+        }
+        if dwt_kernel.shape[-1] == 2:
+            dwt_matrix = dwt_kernel.flatten(1)
+            idwt_matrix = idwt_kernel.flatten(1)
+            weights["haar_conv1"] = torch.einsum(
+                "ocf,fk->ock", conv1, dwt_matrix
+            ).reshape(c * 6, c * 4, 1, 1)
+            weights["haar_conv3"] = torch.einsum(
+                "cfi,fk->cki", conv3, idwt_matrix
+            ).reshape(c * 4, c * 6, 1, 1)
+            weights["haar_bias3"] = torch.einsum(
+                "cf,fk->ck", bias3, idwt_matrix
+            ).reshape(c * 4)
+        self._frozen_weights = weights
+        self._frozen_version = version
+        return weights
+
+    def frozen_forward(self, x):
+        """Forward with precomputed kernels, same result as forward"""
+        _, _, h, w = x.shape
+        weights = self.frozen_weights()
+        # odd sizes are padded by the DWT, attention needs the components
+        if (
+            "haar_conv1" in weights
+            and h % 2 == 0
+            and w % 2 == 0
+            and not (self.use_sa or self.use_ca)
+        ):
+            x = F.pixel_unshuffle(x, 2)
+            x = F.conv2d(x, weights["haar_conv1"], self.conv1.bias)
+            x = self.act(self.conv2(x))
+            x = F.conv2d(x, weights["haar_conv3"], weights["haar_bias3"])
+            return F.pixel_shuffle(x, 2)
+
+        filt_len = weights["dwt"].shape[-1]
+        padb, padt = _get_pad(h, filt_len)
+        padr, padl = _get_pad(w, filt_len)
+        x = F.pad(x, [padl, padr, padt, padb], mode=self.wavedec.mode)
+        x = F.conv2d(x, weights["dwt"], stride=2, groups=self.dim)
+        x = F.conv2d(x, weights["conv1"], self.conv1.bias)
+        x = self.act(self.conv2(x))
+        z = F.conv2d(x, weights["conv3"], weights["bias3"])
+        y = F.conv_transpose2d(z, weights["idwt"], stride=2, groups=self.dim)
+        pad = (2 * filt_len - 3) // 2
+        if pad > 0:
+            y = y[..., pad:-pad, pad:-pad]
+        if not (self.use_sa or self.use_ca):
+            return y
+        b, _, h, w = z.shape
+        components = z.view(b, self.dim, 4, h, w)
+        return self.attend(y, components[:, :, 1], components[:, :, 2])
+
     def get_wavelet_loss(self):
         return self.perfect_reconstruction_loss()[0] + self.alias_cancellation_loss()[0]
 
@@ -370,6 +479,28 @@ class DWT(nn.Module):
 
         l_component = x
         dwt_kernel = construct_2d_filt(lo=self.dec_lo, hi=self.dec_hi)
+        if torch.onnx.is_in_onnx_export():
+            # kernel repeated by traced channel count has unknown shape in onnx,
+            # fold channels into batch and apply the same kernel to every channel
+            dwt_kernel = dwt_kernel.unsqueeze(dim=1)
+            for _ in range(self.level):
+                l_component = fwt_pad2(l_component, self.wavelet, mode=self.mode)
+                _, _, h, w = l_component.shape
+                h_component = F.conv2d(
+                    l_component.reshape(b * c, 1, h, w), dwt_kernel, stride=2
+                )
+                res = h_component.reshape(b, c, 4, h // 2, w // 2)
+                l_component, lh_component, hl_component, hh_component = res.split(1, 2)
+                wavelet_component.append(
+                    (
+                        lh_component.squeeze(2),
+                        hl_component.squeeze(2),
+                        hh_component.squeeze(2),
+                    )
+                )
+            wavelet_component.append(l_component.squeeze(2))
+            return wavelet_component[::-1]
+
         dwt_kernel = dwt_kernel.repeat(c, 1, 1)
         dwt_kernel = dwt_kernel.unsqueeze(dim=1)
         for _ in range(self.level):
@@ -402,9 +533,12 @@ class IDWT(nn.Module):
     def forward(self, x, weight=None):
         l_component = x[0]
         _, c, _, _ = l_component.shape
+        # same kernel for every channel with channels folded into batch, see DWT
+        fold_channels = torch.onnx.is_in_onnx_export() and weight is None
         if weight is None:  # soft orthogonal
             idwt_kernel = construct_2d_filt(lo=self.rec_lo, hi=self.rec_hi)
-            idwt_kernel = idwt_kernel.repeat(c, 1, 1)
+            if not fold_channels:
+                idwt_kernel = idwt_kernel.repeat(c, 1, 1)
             idwt_kernel = idwt_kernel.unsqueeze(dim=1)
         else:  # hard orthogonal
             idwt_kernel = torch.flip(weight, dims=[-1, -2])
@@ -421,11 +555,18 @@ class IDWT(nn.Module):
                 ],
                 2,
             )
-            # cat is not work for the strange transpose
-            l_component = rearrange(l_component, "b c f h w -> b (c f) h w")
-            l_component = F.conv_transpose2d(
-                l_component, idwt_kernel, stride=2, groups=c
-            )
+            if fold_channels:
+                b, _, _, h, w = l_component.shape
+                l_component = F.conv_transpose2d(
+                    l_component.reshape(b * c, 4, h, w), idwt_kernel, stride=2
+                )
+                l_component = l_component.reshape(b, c, 2 * h, 2 * w)
+            else:
+                # cat is not work for the strange transpose
+                l_component = rearrange(l_component, "b c f h w -> b (c f) h w")
+                l_component = F.conv_transpose2d(
+                    l_component, idwt_kernel, stride=2, groups=c
+                )
 
             # remove the padding
             padl = (2 * self.filt_len - 3) // 2
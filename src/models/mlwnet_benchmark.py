@@ -0,0 +1,106 @@
+# python -m src.models.mlwnet_benchmark --size 256
+import argparse
+import logging
+import time
+
+import torch
+
+from src.models.mlwnet.wavelet_block import LWN
+
+
+@torch.no_grad()
+def compare(model, x: torch.Tensor, repeat: int) -> dict:
+    """
+    Compare frozen LWN blocks with the learned-filter path
+
+    Args:
+        model: MLWNet
+        x: input (1, c, h, w)
+        repeat: number of runs, the best one is reported
+
+    Returns:
+        forward time and time of LWN blocks in seconds for both paths, max absolute
+        difference of LWN outputs and of model outputs
+    """
+    blocks = [module for module in model.modules() if isinstance(module, LWN)]
+    starts = {}
+    times = []
+    outputs = []
+
+    def start(module, inputs):
+        starts[module] = time.perf_counter()
+
+    def stop(module, inputs, output):
+        times.append(time.perf_counter() - starts[module])
+        outputs.append(output)
+
+    hooks = []
+    for block in blocks:
+        hooks.append(block.register_forward_pre_hook(start))
+        hooks.append(block.register_forward_hook(stop))
+
+    result = {}
+    block_outputs = {}
+    model_outputs = {}
+    try:
+        for name, frozen in (("learned", False), ("frozen", True)):
+            LWN.frozen = frozen
+            # the first run warms up and fills caches
+            model(x)
+            forward_times = []
+            block_times = []
+            for _ in range(repeat):
+                times.clear()
+                outputs.clear()
+                begin = time.perf_counter()
+                model_outputs[name] = model(x)
+                forward_times.append(time.perf_counter() - begin)
+                block_times.append(sum(times))
+            block_outputs[name] = list(outputs)
+            result[name] = {"time": min(forward_times), "lwn_time": min(block_times)}
+    finally:
+        LWN.frozen = True
+        for hook in hooks:
+            hook.remove()
+
+    result["blocks"] = len(blocks)
+    result["lwn_diff"] = max(
+        (frozen - learned).abs().max().item()
+        for frozen, learned in zip(block_outputs["frozen"], block_outputs["learned"])
+    )
+    result["max_diff"] = (
+        (model_outputs["frozen"] - model_outputs["learned"]).abs().max().item()
+    )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Frozen wavelet blocks of MLWNet")
+    parser.add_argument("--model", default="mlwnet")
+    parser.add_argument("--size", type=int, default=256, help="input size")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from src.models.image_enhance import Enhancer
+    from src.models.registry import get_spec
+
+    spec = get_spec(args.model)
+    model = Enhancer(args.model, device="cpu", backend="torch").build_model(
+        spec, "fp32"
+    )
+    result = compare(model, torch.rand(1, 3, args.size, args.size), args.repeat)
+    for name in ("learned", "frozen"):
+        print(
+            "{:<8} forward {:.3f} s, {} LWN blocks {:.1f} ms".format(
+                name,
+                result[name]["time"],
+                result["blocks"],
+                result[name]["lwn_time"] * 1000,
+            )
+        )
+    print(
+        "max diff of LWN outputs {:.2e}, of model output {:.2e}".format(
+            result["lwn_diff"], result["max_diff"]
+        )
+    )
@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import torch
+from torch import nn
+
+
+def model_size(model: nn.Module) -> int:
+    """
+    Memory occupied by model weights
+
+    Args:
+        model: pytorch model
+
+    Returns:
+        size in bytes
+    """
+    # weights held outside of torch, e.g. by onnxruntime sessions
+    size = getattr(model, "weights_size", 0)
+    # state dict also contains weights of quantized layers
+    for tensor in model.state_dict().values():
+        if isinstance(tensor, torch.Tensor):
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+class ModelCache:
+    """
+    Process-wide LRU cache of loaded models
+
+    Models are stored by key (model name, device, precision, backend). If total size of
+    cached models exceeds the memory budget, least recently used models are evicted.
+
+    Attributes:
+        max_size (int): memory budget in bytes, 0 means no limit
+        hits (int): number of requests served from the cache
+        misses (int): number of requests that loaded a model
+        evictions (int): number of evicted models
+        load_time (float): total time spent on model loading in seconds
+    """
+
+    def __init__(self, max_size: int = 0):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_time = 0.0
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, loader: Callable[[], nn.Module]) -> nn.Module:
+        """
+        Get model from the cache or load it
+
+        Args:
+            key: cache key, (model name, device, precision, backend)
+            loader: function that loads the model if it is not cached
+
+        Returns:
+            loaded model
+        """
+        with self._lock:
+            if key in self._models:
+                self.hits += 1
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            self.misses += 1
+            start = time.perf_counter()
+            model = loader()
+            elapsed = time.perf_counter() - start
+            self.load_time += elapsed
+            logging.info(f"Model {key} loaded in {elapsed:.2f} s")
+
+            self._models[key] = model
+            self._sizes[key] = model_size(model)
+            self._evict()
+            return model
+
+    def _evict(self):
+        """Evict least recently used models until the cache fits the budget"""
+        if self.max_size <= 0:
+            return
+        while self.size > self.max_size and len(self._models) > 1:
+            key, _ = self._models.popitem(last=False)
+            self._sizes.pop(key)
+            self.evictions += 1
+            logging.info(f"Model {key} evicted from cache")
+        if self.size > self.max_size:
+            logging.warning(
+                f"Model {next(iter(self._models))} does not fit the cache budget"
+            )
+
+    def remove(self, key: Hashable):
+        with self._lock:
+            if key in self._models:
+                del self._models[key]
+                del self._sizes[key]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._models)
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._models.items())
+
+    @property
+    def size(self) -> int:
+        """Total size of cached models in bytes"""
+        return sum(self._sizes.values())
+
+    def stats(self) -> dict:
+        """Cache counters"""
+        with self._lock:
+            return {
+                "models": len(self._models),
+                "size_mb": round(self.size / 1024**2, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_time": round(self.load_time, 3),
+            }
+
+
+model_cache = ModelCache(
+    max_size=int(os.getenv("MODEL_CACHE_SIZE_MB", "4096")) * 1024**2
+)
@@ -0,0 +1,272 @@
+# python -m src.models.onnx_backend real_esrgan_x4 mlwnet --size 384
+import argparse
+import glob
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+from src.models.registry import ModelSpec, get_spec
+
+try:
+    import onnxruntime
+except ImportError as error:
+    raise ImportError(
+        "INFERENCE_BACKEND=onnxruntime needs the onnxruntime package from "
+        "requirements.txt"
+    ) from error
+
+ONNX_OPSET = 17
+
+# intra-op threads of onnxruntime sessions, 0 means torch.get_num_threads()
+ORT_NUM_THREADS = int(os.getenv("ORT_NUM_THREADS", "0"))
+
+# static graphs (one per input size) kept on disk and open per model, the least
+# recently used ones are removed
+ORT_MAX_STATIC_GRAPHS = int(os.getenv("ORT_MAX_STATIC_GRAPHS", "8"))
+
+
+def onnx_file(spec: ModelSpec, shape: tuple = None) -> str:
+    """
+    Path to exported graph, e.g. weights/RealESRGAN_x4plus.RRDBNetInference-v2.onnx
+    for the graph with dynamic spatial axes or
+    weights/scunet_color_real_gan.SCUNet-v1.256x256.onnx for a static one. Graphs
+    exported by another model class or version aren't picked up and are exported
+    again.
+    """
+    root = spec.artifact_root
+    if shape is None:
+        return f"{root}.onnx"
+    return f"{root}.{shape[0]}x{shape[1]}.onnx"
+
+
+def prune_static_graphs(spec: ModelSpec, keep: int):
+    """
+    Remove static graphs of model from disk except keep most recently used ones
+    """
+    paths = glob.glob(f"{glob.escape(spec.artifact_root)}.[0-9]*x[0-9]*.onnx")
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def min_input_size(model: nn.Module) -> int:
+    """
+    Smallest input side of exported graph. TLSC pooling of MLWNet is exported
+    without the branch for kernels larger than the input.
+    """
+    from src.models.mlwnet.local_arch import AvgPool2d
+
+    sizes = [
+        max(module.kernel_size)
+        for module in model.modules()
+        if isinstance(module, AvgPool2d) and module.kernel_size is not None
+    ]
+    return max(sizes, default=1)
+
+
+@torch.no_grad()
+def export(model: nn.Module, path: str, shape: tuple, dynamic: bool):
+    """
+    Export fp32 model to onnx, spatial axes are dynamic if dynamic is set
+    """
+    axes = {0: "batch", 2: "height", 3: "width"} if dynamic else {0: "batch"}
+    torch.onnx.export(
+        model,
+        torch.rand(1, 3, *shape, device=next(model.parameters()).device),
+        path + ".tmp",
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={"input": axes, "output": axes},
+        opset_version=ONNX_OPSET,
+    )
+    os.replace(path + ".tmp", path)
+    logging.info(f"Exported {path}")
+
+
+class OrtModel(nn.Module):
+    """
+    Run model through onnxruntime, tensors in and out
+
+    Graphs are exported once and cached next to the weights. If the graph exported
+    with dynamic spatial axes gives wrong results at another input size (e.g. window
+    counts of SCUNet are traced as constants), a static graph is exported for every
+    input size; at most max_static_graphs of them are kept open and on disk, the
+    least recently used are closed and removed.
+
+    Attributes:
+        model (nn.Module): fp32 model, kept for exporting static graphs and for
+            inputs smaller than min_size
+        spec (ModelSpec): model description
+        device (torch.device): cuda uses CUDAExecutionProvider if it is available
+        num_threads (int): intra-op threads, 0 means torch.get_num_threads()
+        min_size (int): smallest input side accepted by the graph
+        dynamic (bool): graph with dynamic spatial axes is used
+        max_static_graphs (int): static graphs kept open and on disk
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        spec: ModelSpec,
+        device: torch.device,
+        num_threads: int = ORT_NUM_THREADS,
+        max_static_graphs: int = ORT_MAX_STATIC_GRAPHS,
+    ):
+        super().__init__()
+        self.model = model
+        self.spec = spec
+        self.device = device
+        self.num_threads = num_threads
+        self.max_static_graphs = max(1, max_static_graphs)
+        self.min_size = min_input_size(model)
+        self._sessions = OrderedDict()
+        self._pid = os.getpid()
+        self.dynamic = os.path.exists(onnx_file(spec)) or self.export_dynamic()
+        if self.dynamic and self.min_size == 1:
+            # weights are in the graph
+            self.model = None
+
+    def export_dynamic(self) -> bool:
+        """
+        Export graph with dynamic spatial axes and check it at another input size
+        """
+        multiple = max(self.spec.pad_multiple, 16)
+        size = multiple * max(2, -(-self.min_size // multiple))
+        path = onnx_file(self.spec)
+        export(self.model, path, (size, size), dynamic=True)
+        x = torch.rand(1, 3, size + multiple, size + 2 * multiple)
+        try:
+            with torch.no_grad():
+                reference = self.model(x.to(self.device)).cpu()
+            output = torch.from_numpy(
+                self.session(path).run(None, {"input": x.numpy()})[0]
+            )
+            if output.shape == reference.shape and torch.allclose(
+                output, reference, atol=1e-3
+            ):
+                return True
+        except Exception as error:
+            logging.debug(error)
+        logging.warning(
+            f"{self.spec.name} can't be exported with dynamic input size, "
+            "exporting graph for every input size"
+        )
+        self._sessions.pop(path, None)
+        os.remove(path)
+        return False
+
+    def session(self, path: str) -> onnxruntime.InferenceSession:
+        # sessions created before fork don't have working thread pools
+        if self._pid != os.getpid():
+            self._sessions.clear()
+            self._pid = os.getpid()
+        if path not in self._sessions:
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.num_threads or torch.get_num_threads()
+            options.inter_op_num_threads = 1
+            providers = ["CPUExecutionProvider"]
+            if (
+                self.device.type == "cuda"
+                and "CUDAExecutionProvider" in onnxruntime.get_available_providers()
+            ):
+                providers.insert(0, "CUDAExecutionProvider")
+            self._sessions[path] = onnxruntime.InferenceSession(
+                path, options, providers=providers
+            )
+        self._sessions.move_to_end(path)
+        return self._sessions[path]
+
+    @property
+    def weights_size(self) -> int:
+        """Size of exported graphs in bytes, used by the model cache"""
+        paths = [onnx_file(self.spec)] if self.dynamic else list(self._sessions)
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if min(x.shape[2:]) < self.min_size:
+            return self.model(x.to(self.device, torch.float32)).cpu()
+
+        if self.dynamic:
+            path = onnx_file(self.spec)
+        else:
+            path = onnx_file(self.spec, x.shape[2:])
+            if not os.path.exists(path):
+                export(self.model, path, x.shape[2:], dynamic=False)
+                prune_static_graphs(self.spec, self.max_static_graphs)
+            else:
+                # mtime orders graphs for pruning
+                os.utime(path)
+            while len(self._sessions) >= self.max_static_graphs and (
+                path not in self._sessions
+            ):
+                self._sessions.popitem(last=False)
+        output = self.session(path).run(
+            None, {"input": x.detach().float().cpu().numpy()}
+        )[0]
+        return torch.from_numpy(output)
+
+
+@torch.no_grad()
+def compare(spec: ModelSpec, size: int, repeat: int = 3) -> dict:
+    """
+    Compare forward time and output of torch fp32 model and onnxruntime
+
+    Args:
+        spec: model description
+        size: input size
+        repeat: number of timed runs
+
+    Returns:
+        best forward times and max absolute difference of outputs
+    """
+    from src.models.image_enhance import Enhancer
+
+    device = torch.device("cpu")
+    enhancer = Enhancer(spec.name, device="cpu", backend="torch")
+    model = enhancer.build_model(spec, "fp32")
+    ort_model = OrtModel(enhancer.build_model(spec, "fp32"), spec, device)
+    x = torch.rand(1, 3, size, size)
+
+    result = {}
+    for name, forward in (("torch", model), ("onnxruntime", ort_model)):
+        # the first run initializes kernels and session
+        result[name] = forward(x)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            forward(x)
+            times.append(time.perf_counter() - start)
+        result[f"{name}_time"] = min(times)
+    result["max_diff"] = (result.pop("torch") - result.pop("onnxruntime")).abs().max()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export models to onnx and compare onnxruntime with torch"
+    )
+    parser.add_argument("models", nargs="*", default=["real_esrgan_x4", "mlwnet"])
+    parser.add_argument("--size", type=int, default=384, help="input size")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    for model_name in args.models:
+        result = compare(get_spec(model_name), args.size)
+        print(
+            "{:<16} torch {:.3f} s, onnxruntime {:.3f} s, max diff {:.2e}".format(
+                model_name,
+                result["torch_time"],
+                result["onnxruntime_time"],
+                result["max_diff"],
+            )
+        )
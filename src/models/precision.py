@@ -0,0 +1,177 @@
+import contextlib
+import json
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Callable
+
+import torch
+from torch import nn
+
+from src.models.registry import BASE_PATH
+
+PRECISIONS = ["fp32", "bf16", "fp16", "int8", "auto"]
+
+# candidates for auto precision, int8 is excluded because it changes the result
+AUTO_CANDIDATES = ["fp32", "bf16", "fp16"]
+
+PRECISION_CACHE = os.getenv(
+    "PRECISION_CACHE", os.path.join(BASE_PATH, "weights", "precision_cache.json")
+)
+
+# cpu flags of native bf16 instructions: x86 and arm
+BF16_CPU_FLAGS = {"avx512_bf16", "amx_bf16", "bf16"}
+
+
+@lru_cache()
+def cpu_flags() -> frozenset:
+    """
+    Flags of the first cpu in /proc/cpuinfo, empty if it isn't available
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return frozenset(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return frozenset()
+
+
+def supported(precision: str, device: torch.device) -> bool:
+    """
+    Device can run precision natively
+    """
+    if precision == "fp32":
+        return True
+    if device.type == "cuda":
+        if precision == "bf16":
+            return torch.cuda.is_bf16_supported()
+        return precision == "fp16"
+    if device.type == "cpu":
+        # fp16 is not supported: cpu kernels of some ops (e.g. replication pad) are missing
+        if precision == "bf16":
+            # mkldnn also reports bf16 emulated with avx512, which is slower than fp32
+            return (
+                bool(BF16_CPU_FLAGS & cpu_flags())
+                and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+            )
+        return precision == "int8"
+    return False
+
+
+def resolve(precision: str, device: torch.device) -> str:
+    """
+    Fall back to fp32 if device can't run precision natively
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}")
+    if precision != "auto" and not supported(precision, device):
+        logging.warning(f"{precision} is not supported on {device}, using fp32")
+        return "fp32"
+    return precision
+
+
+def prepare_model(model: nn.Module, precision: str) -> nn.Module:
+    """
+    Convert model weights for precision
+    """
+    if precision == "fp16":
+        return model.half()
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(
+            model.float(), {nn.Linear}, dtype=torch.qint8
+        )
+    if precision == "fp32":
+        return model.float()
+    return model
+
+
+def autocast(precision: str, device: torch.device):
+    """
+    Autocast context for precision, bf16 weights may be stored in fp32
+    """
+    if precision == "bf16":
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def input_dtype(precision: str) -> torch.dtype:
+    return torch.float16 if precision == "fp16" else torch.float32
+
+
+def device_name(device: torch.device) -> str:
+    """
+    Hardware identifier for the cache of auto precision
+    """
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    with open("/proc/cpuinfo") as f:
+        for line in f:
+            if line.startswith("model name"):
+                return line.split(":", 1)[1].strip()
+    return device.type
+
+
+@torch.no_grad()
+def benchmark(model: nn.Module, precision: str, device: torch.device, size: int = 128):
+    """
+    Best time of model forward on size x size input
+    """
+    x = torch.rand(1, 3, size, size, device=device, dtype=input_dtype(precision))
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        with autocast(precision, device):
+            model(x)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+    # the first run initializes kernels
+    return min(times[1:])
+
+
+def select_precision(
+    model_name: str, device: torch.device, build: Callable[[str], nn.Module]
+) -> str:
+    """
+    Choose the fastest precision for model on this hardware.
+    The choice is cached in PRECISION_CACHE.
+
+    Args:
+        model_name: model name
+        device: device
+        build: function which builds model in given precision
+
+    Returns:
+        precision
+    """
+    key = f"{model_name}|{device_name(device)}|{torch.__version__}"
+    cache = {}
+    if os.path.exists(PRECISION_CACHE):
+        with open(PRECISION_CACHE) as f:
+            cache = json.load(f)
+    if key in cache:
+        return cache[key]
+
+    times = {}
+    for precision in AUTO_CANDIDATES:
+        if not supported(precision, device):
+            continue
+        try:
+            times[precision] = benchmark(build(precision), precision, device)
+        except RuntimeError:
+            logging.warning(f"{model_name} failed in {precision}", exc_info=True)
+    if not times:
+        # not cached, so that the choice is made again after the failure is fixed
+        logging.warning(f"{model_name} failed in all precisions, using fp32")
+        return "fp32"
+    precision = min(times, key=times.get)
+    logging.info(f"Auto precision for {model_name}: {precision}, {times}")
+
+    cache[key] = precision
+    with open(PRECISION_CACHE + ".tmp", "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(PRECISION_CACHE + ".tmp", PRECISION_CACHE)
+    return precision
@@ -0,0 +1,165 @@
+# python -m src.models.quantization real_esrgan_x4 scunet
+import argparse
+import glob
+import logging
+import math
+import os
+import time
+
+import torch
+from PIL import Image
+from torch import nn
+from torch.ao import quantization
+
+from src.models.registry import BASE_PATH, ModelSpec, get_spec
+
+CALIBRATION_IMAGES = os.path.join(
+    os.path.dirname(BASE_PATH), "services", "streamlit_app", "examples"
+)
+
+
+def quantized_weights_file(spec: ModelSpec) -> str:
+    """
+    Path to calibrated int8 weights, e.g.
+    weights/RealESRGAN_x4plus.RRDBNetInference-v2.int8.pt
+    """
+    return f"{spec.artifact_root}.int8.pt"
+
+
+def load_quantized_state(spec: ModelSpec):
+    """
+    Calibrated int8 weights saved by calibrate
+
+    Returns:
+        state dict, None if the model isn't calibrated or was calibrated with
+        another model class or version
+    """
+    path = quantized_weights_file(spec)
+    if not os.path.exists(path):
+        return None
+    saved = torch.load(path, map_location="cpu", weights_only=True)
+    if saved.get("artifact") != spec.artifact_tag:
+        logging.warning(
+            f"{path} was calibrated for {saved.get('artifact')}, not for "
+            f"{spec.artifact_tag}, falling back to dynamic int8. "
+            "Calibrate the model again with python -m src.models.quantization"
+        )
+        return None
+    return saved["state_dict"]
+
+
+def prepare_static(model: nn.Module) -> nn.Module:
+    """
+    Wrap convolutions into quant/dequant stubs and insert observers.
+    Other layers stay in fp32.
+    """
+    torch.backends.quantized.engine = "x86"
+    model.eval()
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if type(child) is nn.Conv2d:
+                wrapper = quantization.QuantWrapper(child)
+                wrapper.qconfig = quantization.get_default_qconfig("x86")
+                setattr(module, name, wrapper)
+    return quantization.prepare(model, inplace=True)
+
+
+def convert(model: nn.Module) -> nn.Module:
+    """
+    Convert observed convolutions to static int8 and linear layers to dynamic int8
+    """
+    quantization.convert(model, inplace=True)
+    return quantization.quantize_dynamic(
+        model, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def load_quantized(model: nn.Module, state_dict: dict) -> nn.Module:
+    """
+    Convert fp32 model to int8 and load calibrated weights
+    """
+    model = convert(prepare_static(model))
+    model.load_state_dict(state_dict)
+    return model
+
+
+def load_images(path: str, size: int) -> list:
+    """
+    Center crops of images used for calibration, tensors (1, c, size, size)
+    """
+    from src.models.image_enhance import image_to_tensor
+
+    images = []
+    for file in sorted(glob.glob(os.path.join(path, "*"))):
+        img = image_to_tensor(Image.open(file).convert("RGB")).unsqueeze(0)
+        _, _, h, w = img.shape
+        top, left = max(0, (h - size) // 2), max(0, (w - size) // 2)
+        images.append(img[:, :, top : top + size, left : left + size])
+    return images
+
+
+def psnr(x: torch.Tensor, y: torch.Tensor) -> float:
+    mse = torch.mean((x.clamp(0, 1) - y.clamp(0, 1)) ** 2).item()
+    return 100.0 if mse == 0 else 10 * math.log10(1 / mse)
+
+
+@torch.no_grad()
+def calibrate(spec: ModelSpec, images: list) -> dict:
+    """
+    Quantize model, save calibrated weights and compare int8 with fp32
+
+    Args:
+        spec: model description
+        images: calibration images
+
+    Returns:
+        PSNR of int8 output against fp32 output and forward times
+    """
+    from src.models.image_enhance import Enhancer
+
+    enhancer = Enhancer(spec.name, device="cpu", precision="fp32", backend="torch")
+    fp32_model = enhancer.build_model(spec, "fp32")
+    model = prepare_static(enhancer.build_model(spec, "fp32"))
+    for img in images:
+        model(img)
+    model = convert(model)
+    torch.save(
+        {"artifact": spec.artifact_tag, "state_dict": model.state_dict()},
+        quantized_weights_file(spec),
+    )
+
+    result = {"psnr": [], "fp32_time": 0.0, "int8_time": 0.0}
+    for img in images:
+        start = time.perf_counter()
+        reference = fp32_model(img)
+        result["fp32_time"] += time.perf_counter() - start
+        start = time.perf_counter()
+        output = model(img)
+        result["int8_time"] += time.perf_counter() - start
+        result["psnr"].append(psnr(output, reference))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calibrate int8 models and compare them with fp32"
+    )
+    parser.add_argument("models", nargs="*", default=["real_esrgan_x4", "scunet"])
+    parser.add_argument("--images", default=CALIBRATION_IMAGES)
+    parser.add_argument("--size", type=int, default=256, help="calibration crop size")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    images = load_images(args.images, args.size)
+    for model_name in args.models:
+        result = calibrate(get_spec(model_name), images)
+        print(
+            "{:<16} PSNR int8 vs fp32: {:.2f} dB (min {:.2f} dB), "
+            "time {:.2f} s -> {:.2f} s".format(
+                model_name,
+                sum(result["psnr"]) / len(result["psnr"]),
+                min(result["psnr"]),
+                result["fp32_time"],
+                result["int8_time"],
+            )
+        )
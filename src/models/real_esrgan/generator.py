@@ -1,11 +1,9 @@
 # from https://github.com/xinntao/Real-ESRGAN.git
 import torch
-from ptflops import get_model_complexity_info
 from torch import nn as nn
 from torch.nn import functional as F
 from torch.nn import init as init
 from torch.nn.modules.batchnorm import _BatchNorm
-from torchinfo import summary
 
 
 @torch.no_grad()
@@ -196,7 +194,108 @@ class RRDBNet(nn.Module):
         return out
 
 
+class RRDBNetInference(RRDBNet):
+    """RRDBNet for inference, loads the same checkpoints as RRDBNet.
+
+    Features of every residual dense block are written into one preallocated
+    dense buffer instead of being concatenated, and the 0.2 residual scale of the
+    blocks is folded into weights and bias of conv5 when the state dict is loaded.
+    The folded buffer is saved with the state dict, so that a state dict of
+    RRDBNetInference is not folded again. The residual scale of RRDB doesn't scale its identity path, so it stays as one
+    in-place multiply before the residual add.
+    """
+
+    # part of names of int8 weights and onnx graphs, bump it when loaded weights
+    # are transformed differently
+    artifact_version = 2
+
+    def __init__(
+        self, num_in_ch, num_out_ch, scale=4, num_feat=64, num_block=23, num_grow_ch=32
+    ):
+        super(RRDBNetInference, self).__init__(
+            num_in_ch, num_out_ch, scale, num_feat, num_block, num_grow_ch
+        )
+        self.num_feat = num_feat
+        self.num_grow_ch = num_grow_ch
+        self.register_buffer("folded", torch.tensor(False))
+        self.register_load_state_dict_pre_hook(self.mark_unfolded)
+        self.register_load_state_dict_post_hook(
+            lambda module, incompatible_keys: module.fold()
+        )
+
+    @staticmethod
+    def mark_unfolded(module, state_dict, prefix, *args):
+        """Checkpoints of RRDBNet have no folded buffer, their conv5 is not folded"""
+        state_dict.setdefault(prefix + "folded", torch.tensor(False))
+
+    @torch.no_grad()
+    def fold(self):
+        """Scale conv5 of residual dense blocks by 0.2, called after loading
+        unless the loaded weights are already folded. Weights of int8 models are
+        loaded after quantization of folded weights.
+        """
+        if self.folded:
+            return
+        # new tensor, the loaded buffer may be memory-mapped
+        self.folded = torch.tensor(True, device=self.folded.device)
+        for rrdb in self.body:
+            for rdb in (rrdb.rdb1, rrdb.rdb2, rrdb.rdb3):
+                if type(rdb.conv5) is not nn.Conv2d:
+                    continue
+                # new tensors, loaded weights may be memory-mapped
+                rdb.conv5.weight = nn.Parameter(rdb.conv5.weight * 0.2)
+                rdb.conv5.bias = nn.Parameter(rdb.conv5.bias * 0.2)
+
+    def dense_block(self, rdb, dense):
+        """Residual dense block on dense buffer, its input and output are the
+        first num_feat channels of the buffer.
+        """
+        convs = (rdb.conv1, rdb.conv2, rdb.conv3, rdb.conv4)
+        for i, conv in enumerate(convs):
+            start = self.num_feat + i * self.num_grow_ch
+            dense[:, start : start + self.num_grow_ch] = F.leaky_relu(
+                conv(dense[:, :start]), negative_slope=0.2, inplace=True
+            )
+        dense[:, : self.num_feat] += rdb.conv5(dense)
+
+    def dense_body(self, feat):
+        """RRDB blocks of body on one dense buffer"""
+        b, _, h, w = feat.shape
+        dense = feat.new_empty(b, self.num_feat + 4 * self.num_grow_ch, h, w)
+        dense[:, : self.num_feat] = feat
+        body = dense[:, : self.num_feat]
+        for rrdb in self.body:
+            identity = body.clone()
+            for rdb in (rrdb.rdb1, rrdb.rdb2, rrdb.rdb3):
+                self.dense_block(rdb, dense)
+            body.mul_(0.2).add_(identity)
+        return body
+
+    def forward(self, x):
+        if self.scale == 2:
+            feat = F.pixel_unshuffle(x, 2)
+        elif self.scale == 1:
+            feat = F.pixel_unshuffle(x, 4)
+        else:
+            feat = x
+        feat = self.conv_first(feat)
+        # the dense buffer is freed before upsampling
+        feat = feat + self.conv_body(self.dense_body(feat))
+        # upsample
+        feat = self.lrelu(
+            self.conv_up1(F.interpolate(feat, scale_factor=2, mode="nearest"))
+        )
+        feat = self.lrelu(
+            self.conv_up2(F.interpolate(feat, scale_factor=2, mode="nearest"))
+        )
+        out = self.conv_last(self.lrelu(self.conv_hr(feat)))
+        return out
+
+
 if __name__ == "__main__":
+    from ptflops import get_model_complexity_info
+    from torchinfo import summary
+
     params = {
         "num_in_ch": 3,
         "num_out_ch": 3,
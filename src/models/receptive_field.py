@@ -0,0 +1,332 @@
+# python -m src.models.receptive_field real_esrgan_x4 scunet --precisions fp32 bf16
+import argparse
+import ctypes
+import json
+import logging
+import math
+import os
+
+import torch
+from torch import nn
+
+from src.models.precision import autocast, input_dtype, resolve
+from src.models.registry import BASE_PATH, ModelSpec, get_spec
+
+TILE_PROFILE = os.getenv(
+    "TILE_PROFILE", os.path.join(BASE_PATH, "weights", "tile_profile.json")
+)
+
+# memory of device classes tiles are recommended for, in bytes
+DEVICE_CLASSES = {
+    "cpu": {"cpu-4gb": 4 * 1024**3, "cpu-16gb": 16 * 1024**3},
+    "cuda": {"cuda-8gb": 8 * 1024**3, "cuda-24gb": 24 * 1024**3},
+}
+
+# part of available memory one forward may take, the rest is left for the image,
+# the model and other processes
+MEMORY_FRACTION = 0.5
+
+# worker processes (src.models.worker_pool) size their tiles independently, each
+# from its share of cpu memory; cuda workers run in one process
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+# output change which is lost in 8 bit rounding
+THRESHOLD = 0.5 / 255
+
+
+@torch.no_grad()
+def receptive_field(
+    model: nn.Module,
+    scale: int,
+    device: torch.device,
+    size: int = 256,
+    threshold: float = THRESHOLD,
+) -> int:
+    """
+    Effective receptive field as seen by the tiler: a random image is cut in half,
+    as a tile window is cut by the tiler, and the farthest output pixel from the
+    cut which differs from the output of the whole image by more than threshold
+    is found. Both axes are measured.
+
+    Args:
+        model: fp32 model
+        scale: upscale factor
+        device: device
+        size: input size, the cut is at a multiple of 64 near the middle
+        threshold: output change to count
+
+    Returns:
+        radius in input pixels, None if the change reaches the opposite border
+    """
+    x = torch.rand(1, 3, size, size, device=device)
+    cut = size // 2 // 64 * 64 or size // 2
+    reference = model(x)
+    radius = 0
+    for dim in (2, 3):
+        half = model(x.narrow(dim, 0, cut))
+        diff = (half - reference.narrow(dim, 0, cut * scale)).abs()
+        changed = torch.nonzero(
+            diff.amax(dim=[d for d in range(4) if d != dim]) > threshold
+        )
+        if len(changed):
+            # distance from the cut in input pixels
+            radius = max(radius, cut - changed.min().item() // scale)
+    if radius >= cut:
+        return None
+    return radius
+
+
+def _trim_heap():
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except OSError:
+        # not glibc
+        pass
+
+
+def _memory_status() -> dict:
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmHWM", "VmRSS")):
+                key, value = line.split(":")
+                status[key] = int(value.split()[0]) * 1024
+    return status
+
+
+@torch.no_grad()
+def peak_memory(
+    model: nn.Module, precision: str, device: torch.device, size: int
+) -> int:
+    """
+    Memory taken by forward of size x size input on top of memory used before it:
+    peak allocated memory on cuda, peak resident memory of the process on cpu
+    (linux only, peak is reset through /proc/self/clear_refs)
+    """
+    x = torch.rand(1, 3, size, size, device=device, dtype=input_dtype(precision))
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        before = torch.cuda.memory_allocated(device)
+    else:
+        # memory freed by previous forwards would be reused by malloc without
+        # raising the resident size
+        _trim_heap()
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        before = _memory_status()["VmRSS"]
+    with autocast(precision, device):
+        output = model(x)
+    del output
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) - before
+    return _memory_status()["VmHWM"] - before
+
+
+def fit_memory(sizes: list, peaks: list) -> dict:
+    """
+    Least squares fit of peak memory as base + per_pixel * size ** 2
+    """
+    areas = [size**2 for size in sizes]
+    mean_area = sum(areas) / len(areas)
+    mean_peak = sum(peaks) / len(peaks)
+    variance = sum((area - mean_area) ** 2 for area in areas)
+    per_pixel = (
+        sum((area - mean_area) * (peak - mean_peak) for area, peak in zip(areas, peaks))
+        / variance
+    )
+    return {"base": max(mean_peak - per_pixel * mean_area, 0.0), "per_pixel": per_pixel}
+
+
+def max_tile_size(
+    spec: ModelSpec, memory: dict, budget: float, tile_pad: int, batch: int = 1
+) -> int:
+    """
+    Largest tile size whose windows fit into memory budget
+
+    Args:
+        spec: model description
+        memory: base and per_pixel memory of one forward
+        budget: memory in bytes
+        tile_pad: tile pad
+        batch: windows in one forward
+
+    Returns:
+        tile size, a multiple of the model's padding multiple, 0 if even the
+        smallest tile doesn't fit
+    """
+    area = (budget * MEMORY_FRACTION / batch - memory["base"]) / memory["per_pixel"]
+    multiple = max(spec.pad_multiple, 8)
+    if area <= 0:
+        return 0
+    return max(int(math.sqrt(area)) - 2 * tile_pad, 0) // multiple * multiple
+
+
+def profile(
+    spec: ModelSpec, device: torch.device, precisions: list, sizes: list, size: int
+) -> dict:
+    """
+    Measure receptive field and memory of model and recommend tiles for device
+    classes of the same device type
+
+    Args:
+        spec: model description
+        device: device
+        precisions: precisions to measure memory for
+        sizes: input sizes to measure memory at
+        size: input size for receptive field
+
+    Returns:
+        receptive field, fitted memory per precision and recommended tile_size
+        and tile_pad per device class
+    """
+    from src.models.image_enhance import Enhancer
+
+    enhancer = Enhancer(spec.name, device=str(device), backend="torch")
+    model = enhancer.build_model(spec, "fp32")
+    radius = receptive_field(model, spec.scale, device, size)
+    del model
+
+    memory = {}
+    for precision in precisions:
+        precision = resolve(precision, device)
+        if precision in memory:
+            continue
+        model = enhancer.build_model(spec, precision)
+        peaks = [peak_memory(model, precision, device, side) for side in sizes]
+        memory[precision] = fit_memory(sizes, peaks)
+        del model
+
+    # the change reaching the border means the field is wider than measured,
+    # keep the configured pad then
+    tile_pad = spec.tile_pad if radius is None else math.ceil(radius / 8) * 8
+    precision = resolve(spec.precision, device)
+    measured = memory.get(precision) or max(
+        memory.values(), key=lambda value: value["per_pixel"]
+    )
+    recommended = {
+        name: {
+            "tile_size": max_tile_size(
+                spec, measured, budget, tile_pad, spec.tile_batch_size
+            ),
+            "tile_pad": tile_pad,
+        }
+        for name, budget in DEVICE_CLASSES[device.type].items()
+    }
+    return {"receptive_field": radius, "memory": memory, "recommended": recommended}
+
+
+def load_profile(model_name: str, device: torch.device) -> dict:
+    """
+    Profile of model measured on device type, None if there is no profile
+    """
+    if not os.path.exists(TILE_PROFILE):
+        return None
+    with open(TILE_PROFILE) as f:
+        return json.load(f).get(model_name, {}).get(device.type)
+
+
+def save_profile(model_name: str, device: torch.device, result: dict):
+    profiles = {}
+    if os.path.exists(TILE_PROFILE):
+        with open(TILE_PROFILE) as f:
+            profiles = json.load(f)
+    profiles.setdefault(model_name, {})[device.type] = result
+    with open(TILE_PROFILE + ".tmp", "w") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(TILE_PROFILE + ".tmp", TILE_PROFILE)
+
+
+def available_memory(device: torch.device) -> int:
+    """
+    Free memory of cuda device, or memory available to processes on cpu limited by
+    the cgroup of the container
+    """
+    if device.type == "cuda":
+        return torch.cuda.mem_get_info(device)[0]
+    with open("/proc/meminfo") as f:
+        available = next(
+            int(line.split()[1]) * 1024 for line in f if line.startswith("MemAvailable")
+        )
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as f:
+            used = int(f.read())
+        if limit != "max":
+            available = min(available, int(limit) - used)
+    except OSError:
+        pass
+    return available
+
+
+def auto_tile_size(
+    spec: ModelSpec,
+    precision: str,
+    device: torch.device,
+    tile_pad: int,
+    batch: int = 1,
+) -> int:
+    """
+    Tile size which fits into memory available now, from the memory profile of
+    the model. On cpu the memory is shared by WORKER_PROCESSES processes.
+
+    Returns:
+        tile size, None if the model is not profiled on this device type
+    """
+    result = load_profile(spec.name, device)
+    if result is None:
+        return None
+    memory = result["memory"].get(precision) or max(
+        result["memory"].values(), key=lambda value: value["per_pixel"]
+    )
+    budget = available_memory(device)
+    if device.type == "cpu":
+        budget //= max(WORKER_PROCESSES, 1)
+    return max_tile_size(spec, memory, budget, tile_pad, batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure receptive field and memory of models and recommend tiles"
+    )
+    parser.add_argument("models", nargs="*", default=["real_esrgan_x4", "scunet"])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16"])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[64, 128, 192], help="memory inputs"
+    )
+    parser.add_argument(
+        "--size", type=int, default=256, help="receptive field input size"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    device = torch.device(args.device)
+    for model_name in args.models:
+        result = profile(
+            get_spec(model_name), device, args.precisions, args.sizes, args.size
+        )
+        save_profile(model_name, device, result)
+        radius = result["receptive_field"]
+        print(
+            "{:<16} receptive field {}".format(
+                model_name,
+                f"{radius} px" if radius is not None else f">{args.size // 2} px",
+            )
+        )
+        for precision, memory in result["memory"].items():
+            print(
+                "{:<16} {:<5} {:.0f} MB + {:.1f} KB per pixel".format(
+                    "",
+                    precision,
+                    memory["base"] / 1024**2,
+                    memory["per_pixel"] / 1024,
+                )
+            )
+        for name, tiles in result["recommended"].items():
+            print(
+                "{:<16} {:<9} tile_size {}, tile_pad {}".format(
+                    "", name, tiles["tile_size"], tiles["tile_pad"]
+                )
+            )
@@ -0,0 +1,135 @@
+import importlib
+import math
+import os
+from functools import lru_cache
+
+import yaml
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(BASE_PATH, "model_configs.yaml")
+
+
+class ModelSpec:
+    """
+    Model description from model_configs.yaml
+
+    Attributes:
+        name (str): model name
+        class_path (str): full path of model class, imported only when the model is built
+        task (str): upscale, deblur or denoise
+        scale (int): upscaling factor
+        tile_size (int): tile size for image splitting
+        tile_pad (int): pad size for tile
+        pre_pad (int): pad size for image
+        tile_batch_size (int): number of tiles in one forward
+        tile_merge (str): crop or blend, how outputs of tile windows are merged
+        tile_cache (bool): outputs of tile windows are cached if the tile cache is
+            enabled
+        flat_threshold (float): tiles without steps between neighbouring pixels
+            above this value skip the network, 0 disables skipping
+        pad_multiple (int): the network pads its input to a multiple of this value
+        window_size (int): attention window size, None for convolutional networks
+        precision (str): preferred precision
+        weights_path (str): path to weights relative to models directory
+        state_dict_key (str): key of state dict in checkpoint, None if checkpoint is state dict
+        params (dict): model parameters
+    """
+
+    def __init__(self, name: str, config: dict):
+        self.name = name
+        self.class_path = config["class_path"]
+        self.task = config["task"]
+        self.scale = config["scale"]
+        self.tile_size = config["tile_size"]
+        self.tile_pad = config["tile_pad"]
+        self.pre_pad = config["pre_pad"]
+        self.tile_batch_size = config.get("tile_batch_size", 1)
+        self.tile_merge = config.get("tile_merge", "crop")
+        self.flat_threshold = config.get("flat_threshold", 0.0)
+        self.tile_cache = config.get("tile_cache", True)
+        self.pad_multiple = config.get("pad_multiple", 1)
+        self.window_size = config.get("window_size")
+        self.precision = config.get("precision", "bf16")
+        self.weights_path = config["weights_path"]
+        self.state_dict_key = config.get("state_dict_key")
+        self.params = config.get("params", {})
+
+    @property
+    def weights_file(self) -> str:
+        """Absolute path to weights"""
+        return os.path.join(BASE_PATH, self.weights_path)
+
+    @property
+    def artifact_tag(self) -> str:
+        """
+        Model class name and its artifact_version, e.g. RRDBNetInference-v2.
+        Int8 weights and onnx graphs keep weights as the class transforms them after
+        loading, so artifacts built by another class or version are stale.
+        """
+        model_class = self.load_class()
+        return f"{model_class.__name__}-v{getattr(model_class, 'artifact_version', 1)}"
+
+    @property
+    def artifact_root(self) -> str:
+        """
+        Path prefix of artifacts built from weights, e.g.
+        weights/RealESRGAN_x4plus.RRDBNetInference-v2
+        """
+        root, _ = os.path.splitext(self.weights_file)
+        return f"{root}.{self.artifact_tag}"
+
+    @property
+    def tile_multiple(self) -> int:
+        """
+        Tile windows are aligned to this value, so that the network doesn't pad them
+        """
+        return math.lcm(self.pad_multiple, self.window_size or 1)
+
+    @property
+    def available(self) -> bool:
+        """Weights of the model are present"""
+        return os.path.exists(self.weights_file)
+
+    def load_class(self):
+        """Import model class"""
+        module_name, class_name = self.class_path.rsplit(".", 1)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def describe(self) -> dict:
+        """Short description for model selection in API"""
+        return {"task": self.task, "scale": self.scale}
+
+
+@lru_cache()
+def load_registry(path: str = CONFIG_PATH) -> dict:
+    """
+    Parse model configs once per process
+
+    Returns:
+        dict of model name and ModelSpec
+    """
+    with open(path) as f:
+        configs = yaml.safe_load(f)
+    return {name: ModelSpec(name, config) for name, config in configs.items()}
+
+
+def get_spec(model_name: str) -> ModelSpec:
+    registry = load_registry()
+    if model_name not in registry:
+        raise ValueError("Model not found")
+    return registry[model_name]
+
+
+def model_names() -> list:
+    return list(load_registry())
+
+
+def describe(available_only: bool = True) -> dict:
+    """
+    Models which can be served, published by worker for API
+    """
+    return {
+        name: spec.describe()
+        for name, spec in load_registry().items()
+        if spec.available or not available_only
+    }
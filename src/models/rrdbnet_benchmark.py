@@ -0,0 +1,93 @@
+# python -m src.models.rrdbnet_benchmark real_esrgan_x2 real_esrgan_x4 --size 128
+import argparse
+import logging
+import time
+
+import torch
+
+from src.models.precision import autocast, resolve
+from src.models.quantization import psnr
+from src.models.real_esrgan.generator import RRDBNet, RRDBNetInference
+from src.models.receptive_field import peak_memory
+from src.models.registry import get_spec
+from src.models.weights_io import load_state_dict
+
+
+@torch.no_grad()
+def compare(model_name: str, size: int, precision: str, repeat: int) -> dict:
+    """
+    Compare RRDBNetInference with RRDBNet loaded from the same checkpoint
+
+    Args:
+        model_name: RRDBNet model from model_configs.yaml
+        size: input size
+        precision: fp32 or bf16
+        repeat: number of runs, the best one is reported
+
+    Returns:
+        max absolute difference of outputs, and PSNR against fp32 output of
+        RRDBNet, forward time in seconds and peak memory in bytes of both models
+    """
+    spec = get_spec(model_name)
+    device = torch.device("cpu")
+    precision = resolve(precision, device)
+    state_dict = load_state_dict(spec)
+    x = torch.rand(1, 3, size, size)
+
+    result = {}
+    outputs = {}
+    reference = None
+    for name, model_class in (("original", RRDBNet), ("inference", RRDBNetInference)):
+        model = model_class(**spec.params)
+        model.load_state_dict(state_dict, strict=True)
+        model.eval()
+        if reference is None:
+            reference = model(x)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with autocast(precision, device):
+                outputs[name] = model(x).float()
+            times.append(time.perf_counter() - start)
+        result[name] = {
+            "time": min(times),
+            "memory": peak_memory(model, precision, device, size),
+            "psnr": psnr(outputs[name], reference),
+        }
+    result["max_diff"] = (outputs["inference"] - outputs["original"]).abs().max().item()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare inference RRDBNet with the original"
+    )
+    parser.add_argument(
+        "models", nargs="*", default=["real_esrgan_x2", "real_esrgan_x4"]
+    )
+    parser.add_argument("--size", type=int, default=128, help="input size")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for model_name in args.models:
+        for precision in args.precisions:
+            result = compare(model_name, args.size, precision, args.repeat)
+            for name in ("original", "inference"):
+                print(
+                    "{:<16} {:<5} {:<9} {:.3f} s, peak {:.0f} MB, "
+                    "PSNR vs fp32 original {:.1f} dB".format(
+                        model_name,
+                        precision,
+                        name,
+                        result[name]["time"],
+                        result[name]["memory"] / 1024**2,
+                        result[name]["psnr"],
+                    )
+                )
+            print(
+                "{:<16} {:<5} max diff {:.2e}".format(
+                    model_name, precision, result["max_diff"]
+                )
+            )
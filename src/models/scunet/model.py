@@ -1,17 +1,80 @@
 # -*- coding: utf-8 -*-
+import os
+from functools import lru_cache
+
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from einops import rearrange
 from einops.layers.torch import Rearrange
-from ptflops import get_model_complexity_info
-from timm.layers import DropPath, trunc_normal_
-from torchinfo import summary
+from torch.nn.init import trunc_normal_
+
+# attention of WMSA: "sdpa" (scaled_dot_product_attention) or "einsum"
+ATTENTION_BACKEND = os.getenv("ATTENTION_BACKEND", "sdpa")
+
+# memory cap of attention scores of one sdpa call in MB, windows are processed in
+# chunks of window rows under it, 0 disables chunking
+ATTENTION_MEMORY_MB = int(os.getenv("ATTENTION_MEMORY_MB", "0"))
+
+
+@lru_cache()
+def shift_masks(p, shift, device):
+    """Masks of SW-MSA for the last row and the last column of windows
+    Args:
+        p: window size
+        shift: shift parameters in CyclicShift.
+        device: device of masks
+    Returns:
+        row_mask, col_mask: (p*p p*p) bool, True where pixels of a window come
+            from different sides of the cyclic shift
+    """
+    s = p - shift
+    side = torch.arange(p, device=device) < s
+    # pixel (p1, p2) of window, rows and columns are flattened as in WMSA
+    rows = side.repeat_interleave(p)
+    cols = side.repeat(p)
+    row_mask = rows[:, None] != rows[None, :]
+    col_mask = cols[:, None] != cols[None, :]
+    return row_mask, col_mask
+
+
+@lru_cache(maxsize=16)
+def window_index(height, width, p, shift, device):
+    """Order of pixels in windows of the image rolled by -shift
+    Args:
+        height, width: image size, multiples of p
+        p: window size
+        shift: cyclic shift, 0 for W-MSA
+        device: device of index
+    Returns:
+        index: (h*w) pixel of flattened image for every pixel of windows
+            (b (w1 w2) (p1 p2) c)
+        inverse: (h*w) pixel of windows for every pixel of image
+    """
+    rows = (torch.arange(height, device=device) + shift) % height
+    cols = (torch.arange(width, device=device) + shift) % width
+    index = rearrange(
+        rows[:, None] * width + cols[None, :],
+        "(w1 p1) (w2 p2) -> (w1 w2 p1 p2)",
+        p1=p,
+        p2=p,
+    )
+    return index, torch.argsort(index)
 
 
 class WMSA(nn.Module):
     """Self-attention module in Swin Transformer"""
 
+    # inference mode: the relative bias is materialized once and shift masks are
+    # cached instead of being rebuilt on every forward
+    precompute = True
+    backend = ATTENTION_BACKEND
+    # windows are gathered from the image by a cached index instead of roll and
+    # rearrange copies
+    gather_windows = True
+    max_attention_memory = ATTENTION_MEMORY_MB * 1024**2
+
     def __init__(self, input_dim, output_dim, head_dim, window_size, type):
         super(WMSA, self).__init__()
         self.input_dim = input_dim
@@ -40,6 +103,18 @@ class WMSA(nn.Module):
             .transpose(0, 1)
         )
 
+        cord = torch.stack(
+            torch.meshgrid(
+                torch.arange(window_size), torch.arange(window_size), indexing="ij"
+            ),
+            dim=-1,
+        ).view(-1, 2)
+        relation = cord[:, None, :] - cord[None, :, :] + window_size - 1
+        # not in state dict, checkpoints are unchanged
+        self.register_buffer("relative_index", relation, persistent=False)
+        self._relative_bias = None
+        self._relative_bias_version = None
+
     def generate_mask(self, h, w, p, shift):
         """generating the mask of SW-MSA
         Args:
@@ -79,61 +154,149 @@ class WMSA(nn.Module):
         Returns:
             output: tensor shape [b h w c]
         """
-        if self.type != "W":
-            x = torch.roll(
-                x,
-                shifts=(-(self.window_size // 2), -(self.window_size // 2)),
-                dims=(1, 2),
-            )
-        x = rearrange(
-            x,
-            "b (w1 p1) (w2 p2) c -> b w1 w2 p1 p2 c",
-            p1=self.window_size,
-            p2=self.window_size,
-        )
-        h_windows = x.size(1)
-        w_windows = x.size(2)
-        # sqaure validation
-        # assert h_windows == w_windows
-
-        x = rearrange(
-            x,
-            "b w1 w2 p1 p2 c -> b (w1 w2) (p1 p2) c",
-            p1=self.window_size,
-            p2=self.window_size,
-        )
+        b, height, width, c = x.shape
+        p = self.window_size
+        h_windows = height // p
+        w_windows = width // p
+        shift = p // 2 if self.type != "W" else 0
+        if self.gather_windows:
+            # cyclic shift and window partition in one copy
+            index, inverse = window_index(height, width, p, shift, x.device)
+            x = x.reshape(b, height * width, c).index_select(1, index)
+            x = x.view(b, h_windows * w_windows, p * p, c)
+        else:
+            if self.type != "W":
+                x = torch.roll(x, shifts=(-shift, -shift), dims=(1, 2))
+            x = rearrange(x, "b (w1 p1) (w2 p2) c -> b (w1 w2) (p1 p2) c", p1=p, p2=p)
+
         qkv = self.embedding_layer(x)
+        if self.precompute and self.backend == "sdpa":
+            output = self.sdpa_attention(qkv, h_windows, w_windows)
+        else:
+            output = self.einsum_attention(qkv, h_windows, w_windows)
+        output = self.linear(output)
+
+        if self.gather_windows:
+            output = output.reshape(b, height * width, -1).index_select(1, inverse)
+            return output.view(b, height, width, -1)
+        output = rearrange(
+            output, "b (w1 w2) (p1 p2) c -> b (w1 p1) (w2 p2) c", w1=h_windows, p1=p
+        )
+        if self.type != "W":
+            output = torch.roll(output, shifts=(shift, shift), dims=(1, 2))
+        return output
+
+    def einsum_attention(self, qkv, h_windows, w_windows):
+        """Attention by einsum with the full matrix of scores
+        Args:
+            qkv: (b nw np (3 h c))
+        Returns:
+            output: (b nw np (h c))
+        """
         q, k, v = rearrange(
             qkv, "b nw np (threeh c) -> threeh b nw np c", c=self.head_dim
         ).chunk(3, dim=0)
         sim = torch.einsum("hbwpc,hbwqc->hbwpq", q, k) * self.scale
-        # Adding learnable relative embedding
-        sim = sim + rearrange(self.relative_embedding(), "h p q -> h 1 1 p q")
-        # Using Attn Mask to distinguish different subwindows.
-        if self.type != "W":
-            attn_mask = self.generate_mask(
-                h_windows, w_windows, self.window_size, shift=self.window_size // 2
-            )
-            sim = sim.masked_fill_(attn_mask, float("-inf"))
+        if not self.precompute:
+            # Adding learnable relative embedding
+            sim = sim + rearrange(self.relative_embedding(), "h p q -> h 1 1 p q")
+            # Using Attn Mask to distinguish different subwindows.
+            if self.type != "W":
+                attn_mask = self.generate_mask(
+                    h_windows, w_windows, self.window_size, shift=self.window_size // 2
+                )
+                sim = sim.masked_fill_(attn_mask, float("-inf"))
+        else:
+            sim = sim + rearrange(self.relative_bias(), "h p q -> h 1 1 p q")
+            if self.type != "W":
+                # only windows of the last row and column mix shifted pixels
+                row_mask, col_mask = shift_masks(
+                    self.window_size, self.window_size // 2, sim.device
+                )
+                windows = sim.view(*sim.shape[:2], h_windows, w_windows, *sim.shape[3:])
+                windows[:, :, -1].masked_fill_(row_mask, float("-inf"))
+                windows[:, :, :, -1].masked_fill_(col_mask, float("-inf"))
 
         probs = nn.functional.softmax(sim, dim=-1)
         output = torch.einsum("hbwij,hbwjc->hbwic", probs, v)
-        output = rearrange(output, "h b w p c -> b w p (h c)")
-        output = self.linear(output)
-        output = rearrange(
-            output,
-            "b (w1 w2) (p1 p2) c -> b (w1 p1) (w2 p2) c",
-            w1=h_windows,
-            p1=self.window_size,
+        return rearrange(output, "h b w p c -> b w p (h c)")
+
+    def sdpa_attention(self, qkv, h_windows, w_windows):
+        """Attention by scaled_dot_product_attention
+        Windows of a row share one additive mask of relative bias and shift mask,
+        so the mask is (w_windows * heads, np, np) instead of one per window.
+        Rows are processed in chunks if scores exceed max_attention_memory.
+        Args:
+            qkv: (b nw np (3 h c))
+        Returns:
+            output: (b nw np (h c))
+        """
+        b, _, n, _ = qkv.shape
+        qkv = qkv.view(b, h_windows, w_windows, n, 3, self.n_heads, self.head_dim)
+        # (3 (b w1) (w2 h) np c), windows of a row are heads of one sdpa batch
+        q, k, v = (
+            qkv.permute(4, 0, 1, 2, 5, 3, 6)
+            .reshape(3, b * h_windows, w_windows * self.n_heads, n, self.head_dim)
+            .unbind(0)
         )
 
+        bias = self.relative_bias().to(q.dtype)
+        mask = bias.expand(w_windows, -1, -1, -1)
+        last_mask = mask
         if self.type != "W":
-            output = torch.roll(
-                output,
-                shifts=(self.window_size // 2, self.window_size // 2),
-                dims=(1, 2),
+            row_mask, col_mask = shift_masks(
+                self.window_size, self.window_size // 2, q.device
             )
-        return output
+            mask = mask.clone()
+            mask[-1] = mask[-1].masked_fill(col_mask, float("-inf"))
+            last_mask = mask.masked_fill(row_mask, float("-inf"))
+        mask = mask.reshape(1, w_windows * self.n_heads, n, n)
+        last_mask = last_mask.reshape(1, w_windows * self.n_heads, n, n)
+
+        # the last row of every image has its own mask
+        if self.type == "W":
+            parts = [(0, b * h_windows, mask)]
+        else:
+            parts = []
+            for end in range(h_windows - 1, b * h_windows, h_windows):
+                parts += [(end - h_windows + 1, end, mask), (end, end + 1, last_mask)]
+        step = b * h_windows
+        if self.max_attention_memory > 0:
+            row_size = w_windows * self.n_heads * n * n * q.element_size()
+            step = max(self.max_attention_memory // row_size, 1)
+
+        output = torch.empty_like(q)
+        for start, end, part_mask in parts:
+            for top in range(start, end, step):
+                bottom = min(top + step, end)
+                output[top:bottom] = F.scaled_dot_product_attention(
+                    q[top:bottom],
+                    k[top:bottom],
+                    v[top:bottom],
+                    attn_mask=part_mask,
+                    scale=self.scale,
+                )
+        output = output.view(b, h_windows, w_windows, self.n_heads, n, self.head_dim)
+        return output.permute(0, 1, 2, 4, 3, 5).reshape(
+            b, h_windows * w_windows, n, self.n_heads * self.head_dim
+        )
+
+    def relative_bias(self):
+        """Relative embedding, materialized once for inference"""
+        # compiled graphs and training gather from the parameters
+        if self.training or torch.is_grad_enabled() or torch.compiler.is_compiling():
+            return self.relative_position_params[
+                :, self.relative_index[..., 0], self.relative_index[..., 1]
+            ]
+        params = self.relative_position_params
+        # weights may be loaded or converted after the first forward
+        version = (params._version, params.data_ptr(), params.dtype, params.device)
+        if self._relative_bias_version != version:
+            self._relative_bias = params[
+                :, self.relative_index[..., 0], self.relative_index[..., 1]
+            ]
+            self._relative_bias_version = version
+        return self._relative_bias
 
     def relative_embedding(self):
         cord = torch.tensor(
@@ -174,7 +337,13 @@ class Block(nn.Module):
 
         self.ln1 = nn.LayerNorm(input_dim)
         self.msa = WMSA(input_dim, input_dim, head_dim, window_size, self.type)
-        self.drop_path = DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
+        if drop_path > 0.0:
+            # timm is needed only for training
+            from timm.layers import DropPath
+
+            self.drop_path = DropPath(drop_path)
+        else:
+            self.drop_path = nn.Identity()
         self.ln2 = nn.LayerNorm(input_dim)
         self.mlp = nn.Sequential(
             nn.Linear(input_dim, 4 * input_dim),
@@ -189,6 +358,10 @@ class Block(nn.Module):
 
 
 class ConvTransBlock(nn.Module):
+    # activations stay channels last: 1x1 convs run as linears on NHWC views and
+    # the transformer branch needs no permute copies
+    channels_last = True
+
     def __init__(
         self,
         conv_dim,
@@ -246,6 +419,9 @@ class ConvTransBlock(nn.Module):
         )
 
     def forward(self, x):
+        # int8 models wrap convolutions into quant stubs
+        if self.channels_last and type(self.conv1_1) is nn.Conv2d:
+            return self.forward_channels_last(x)
         conv_x, trans_x = torch.split(
             self.conv1_1(x), (self.conv_dim, self.trans_dim), dim=1
         )
@@ -258,6 +434,21 @@ class ConvTransBlock(nn.Module):
 
         return x
 
+    def forward_channels_last(self, x):
+        """Forward of channels_last tensor, NHWC permutes of it are views"""
+        y = F.linear(
+            x.permute(0, 2, 3, 1), self.conv1_1.weight.flatten(1), self.conv1_1.bias
+        )
+        conv_x = y[..., : self.conv_dim].permute(0, 3, 1, 2)
+        conv_x = conv_x.contiguous(memory_format=torch.channels_last)
+        conv_x = self.conv_block(conv_x) + conv_x
+        trans_x = self.trans_block(y[..., self.conv_dim :])
+        # conv1_2 of the concatenation is a sum of linears of its parts
+        weight = self.conv1_2.weight.flatten(1)
+        res = F.linear(trans_x, weight[:, self.conv_dim :], self.conv1_2.bias)
+        res += F.linear(conv_x.permute(0, 2, 3, 1), weight[:, : self.conv_dim])
+        return x + res.permute(0, 3, 1, 2)
+
 
 class SCUNet(nn.Module):
     def __init__(
@@ -393,9 +584,12 @@ class SCUNet(nn.Module):
     def forward(self, x0):
 
         h, w = x0.size()[-2:]
-        paddingBottom = int(np.ceil(h / 64) * 64 - h)
-        paddingRight = int(np.ceil(w / 64) * 64 - w)
+        # integer arithmetic is traced by onnx export, np.ceil is not
+        paddingBottom = (64 - h % 64) % 64
+        paddingRight = (64 - w % 64) % 64
         x0 = nn.ReplicationPad2d((0, paddingRight, 0, paddingBottom))(x0)
+        if ConvTransBlock.channels_last:
+            x0 = x0.contiguous(memory_format=torch.channels_last)
 
         x1 = self.m_head(x0)
         x2 = self.m_down1(x1)
@@ -422,6 +616,9 @@ class SCUNet(nn.Module):
 
 
 if __name__ == "__main__":
+    from ptflops import get_model_complexity_info
+    from torchinfo import summary
+
     model = SCUNet(in_nc=3, config=[4, 4, 4, 4, 4, 4, 4], dim=64)
 
     summary(
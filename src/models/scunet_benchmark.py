@@ -0,0 +1,236 @@
+# python -m src.models.scunet_benchmark --size 128
+import argparse
+import contextlib
+import logging
+import time
+
+import torch
+
+from src.models.receptive_field import peak_memory
+from src.models.scunet.model import WMSA, ConvTransBlock, shift_masks
+
+# switches of inference paths and classes they are set on
+SETTINGS = {
+    "precompute": WMSA,
+    "backend": WMSA,
+    "max_attention_memory": WMSA,
+    "gather_windows": WMSA,
+    "channels_last": ConvTransBlock,
+}
+
+# settings of the model before inference paths were added
+LEGACY = {"precompute": False, "gather_windows": False, "channels_last": False}
+
+
+def _time(fn, repeat: int) -> float:
+    """Best time of fn in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def attention_blocks(model) -> list:
+    """WMSA modules of model"""
+    return [module for module in model.modules() if isinstance(module, WMSA)]
+
+
+@torch.no_grad()
+def block_overhead(msa: WMSA, h_windows: int, w_windows: int, repeat: int) -> dict:
+    """
+    Time of relative bias and shift mask of one attention block, rebuilt on every
+    forward (legacy) and precomputed
+
+    Returns:
+        legacy and precomputed time in seconds
+    """
+    p = msa.window_size
+
+    def legacy():
+        msa.relative_embedding()
+        if msa.type != "W":
+            msa.generate_mask(h_windows, w_windows, p, shift=p // 2)
+
+    def precomputed():
+        msa.relative_bias()
+        if msa.type != "W":
+            shift_masks(p, p // 2, msa.relative_position_params.device)
+
+    return {"legacy": _time(legacy, repeat), "precomputed": _time(precomputed, repeat)}
+
+
+@contextlib.contextmanager
+def configure(**settings):
+    """Set SETTINGS of SCUNet classes, defaults are restored on exit"""
+    defaults = {name: getattr(SETTINGS[name], name) for name in settings}
+    for name, value in settings.items():
+        setattr(SETTINGS[name], name, value)
+    try:
+        yield
+    finally:
+        for name, value in defaults.items():
+            setattr(SETTINGS[name], name, value)
+
+
+@torch.no_grad()
+def forward_time(model, x: torch.Tensor, repeat: int, **settings) -> dict:
+    """
+    Time and peak memory of model forward with settings
+
+    Args:
+        model: SCUNet
+        x: input (1, c, h, w)
+        repeat: number of runs, the best one is reported
+        settings: SETTINGS, such as precompute, backend and max_attention_memory
+
+    Returns:
+        time in seconds, peak memory in bytes and output
+    """
+    with configure(**settings):
+        output = model(x)
+        return {
+            "time": _time(lambda: model(x), repeat),
+            "memory": peak_memory(model, "fp32", x.device, x.shape[-1]),
+            "output": output,
+        }
+
+
+@torch.no_grad()
+def block_times(model, x: torch.Tensor, repeat: int, **settings) -> dict:
+    """
+    Time of every block of the U-Net: ConvTransBlocks, down and up convolutions,
+    head and tail
+
+    Returns:
+        best time in seconds by block name, e.g. m_down1.0
+    """
+    blocks = {
+        f"{name}.{index}": block
+        for name, stage in model.named_children()
+        for index, block in enumerate(stage)
+    }
+    names = {block: name for name, block in blocks.items()}
+    starts = {}
+    times = {name: [] for name in blocks}
+
+    def start(module, inputs):
+        starts[module] = time.perf_counter()
+
+    def stop(module, inputs, output):
+        times[names[module]].append(time.perf_counter() - starts[module])
+
+    hooks = []
+    for block in blocks.values():
+        hooks.append(block.register_forward_pre_hook(start))
+        hooks.append(block.register_forward_hook(stop))
+    try:
+        with configure(**settings):
+            for _ in range(repeat + 1):
+                model(x)
+    finally:
+        for hook in hooks:
+            hook.remove()
+    # the first run warms up
+    return {name: min(values[1:]) for name, values in times.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SCUNet attention benchmark")
+    parser.add_argument("--model", default="scunet")
+    parser.add_argument("--size", type=int, default=128, help="input size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max-memory-mb", type=int, default=16, help="attention memory cap of sdpa"
+    )
+    parser.add_argument(
+        "--blocks", action="store_true", help="time of every block, NCHW and NHWC"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from src.models.image_enhance import Enhancer
+    from src.models.registry import get_spec
+
+    spec = get_spec(args.model)
+    model = Enhancer(args.model, device="cpu", backend="torch").build_model(
+        spec, "fp32"
+    )
+    x = torch.rand(1, 3, args.size, args.size)
+
+    # windows of every block, recorded during one forward
+    shapes = {}
+
+    def record(module, inputs):
+        shapes[module] = inputs[0].shape
+
+    hooks = [msa.register_forward_pre_hook(record) for msa in attention_blocks(model)]
+    with torch.no_grad():
+        model(x)
+    for hook in hooks:
+        hook.remove()
+
+    total = {"legacy": 0.0, "precomputed": 0.0}
+    for msa, shape in shapes.items():
+        h_windows = shape[1] // msa.window_size
+        w_windows = shape[2] // msa.window_size
+        overhead = block_overhead(msa, h_windows, w_windows, args.repeat * 10)
+        for name in total:
+            total[name] += overhead[name]
+    print(
+        "bias and masks of {} blocks: legacy {:.2f} ms, precomputed {:.2f} ms".format(
+            len(shapes),
+            total["legacy"] * 1000,
+            total["precomputed"] * 1000,
+        )
+    )
+
+    runs = {
+        "legacy": LEGACY,
+        "nchw": {"gather_windows": False, "channels_last": False},
+        "einsum": {"backend": "einsum"},
+        "sdpa": {"backend": "sdpa", "max_attention_memory": 0},
+        f"sdpa {args.max_memory_mb} MB": {
+            "backend": "sdpa",
+            "max_attention_memory": args.max_memory_mb * 1024**2,
+        },
+    }
+    reference = None
+    for name, attention in runs.items():
+        result = forward_time(model, x, args.repeat, **attention)
+        if reference is None:
+            reference = result["output"]
+        print(
+            "forward {}x{} {:<12} {:.3f} s, peak {:.0f} MB, max diff {:.2e}".format(
+                args.size,
+                args.size,
+                name,
+                result["time"],
+                result["memory"] / 1024**2,
+                (result["output"] - reference).abs().max().item(),
+            )
+        )
+
+    if args.blocks:
+        before = block_times(
+            model, x, args.repeat, gather_windows=False, channels_last=False
+        )
+        after = block_times(model, x, args.repeat)
+        for name in before:
+            print(
+                "{:<10} nchw {:7.2f} ms, nhwc {:7.2f} ms ({:+.0%})".format(
+                    name,
+                    before[name] * 1000,
+                    after[name] * 1000,
+                    after[name] / before[name] - 1,
+                )
+            )
+        print(
+            "{:<10} nchw {:7.2f} ms, nhwc {:7.2f} ms ({:+.0%})".format(
+                "total",
+                sum(before.values()) * 1000,
+                sum(after.values()) * 1000,
+                sum(after.values()) / sum(before.values()) - 1,
+            )
+        )
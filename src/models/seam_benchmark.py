@@ -0,0 +1,105 @@
+# python -m src.models.seam_benchmark real_esrgan_x4 scunet --tile-size 128
+import argparse
+import logging
+
+import torch
+
+from src.models.quantization import CALIBRATION_IMAGES, load_images, psnr
+
+
+@torch.no_grad()
+def run(enhancer, img: torch.Tensor) -> torch.Tensor:
+    """
+    Enhance image tensor (1, c, h, w) without conversion to uint8
+    """
+    enhancer.load_model()
+    enhancer.pre_process(img)
+    if enhancer.tile_size > 0:
+        enhancer.tile_process()
+    else:
+        enhancer.process()
+    return enhancer.post_process()
+
+
+def window_pixels(enhancer) -> float:
+    """
+    Input pixels processed by the network per pixel of pre-processed image
+    """
+    _, _, height, width = enhancer.img.shape
+    tiles = enhancer.plan_tiles()
+    pixels = sum(tile.window_height * tile.window_width for tile in tiles)
+    return pixels / (height * width)
+
+
+def compare(
+    model_name: str, images: list, tile_size: int, pads: list, merges: list
+) -> list:
+    """
+    Compare tiled output with output of the whole image
+
+    Args:
+        model_name: model name
+        images: image tensors (1, c, h, w)
+        tile_size: tile size
+        pads: tile pads
+        merges: tile merge modes
+
+    Returns:
+        list of dicts with merge, pad, processed pixels per image pixel, worst
+        PSNR and max absolute difference against untiled output
+    """
+    from src.models.image_enhance import Enhancer
+
+    def enhancer(**kwargs):
+        return Enhancer(
+            model_name, device="cpu", precision="fp32", backend="torch", **kwargs
+        )
+
+    references = [run(enhancer(tile_size=0), img) for img in images]
+    results = []
+    for merge in merges:
+        for pad in pads:
+            tiled = enhancer(tile_size=tile_size, tile_pad=pad, tile_merge=merge)
+            result = {"merge": merge, "pad": pad, "psnr": 100.0, "max_diff": 0.0}
+            for img, reference in zip(images, references):
+                output = run(tiled, img)
+                result["pixels"] = window_pixels(tiled)
+                result["psnr"] = min(result["psnr"], psnr(output, reference))
+                result["max_diff"] = max(
+                    result["max_diff"], (output - reference).abs().max().item()
+                )
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Seam error of tile merge modes against untiled inference"
+    )
+    parser.add_argument("models", nargs="*", default=["real_esrgan_x4", "scunet"])
+    parser.add_argument("--images", default=CALIBRATION_IMAGES)
+    parser.add_argument("--size", type=int, default=256, help="image crop size")
+    parser.add_argument("--tile-size", type=int, default=128)
+    parser.add_argument("--pads", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--merges", nargs="+", default=["crop", "blend"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    images = load_images(args.images, args.size)
+    for model_name in args.models:
+        results = compare(model_name, images, args.tile_size, args.pads, args.merges)
+        # compute is compared with crop merge and the largest pad
+        baseline = max(results, key=lambda result: result["pixels"])["pixels"]
+        for result in results:
+            print(
+                "{:<16} {:<5} pad {:>3}: compute {:.2f}x ({:+.0%}), "
+                "PSNR vs untiled {:.2f} dB, max diff {:.3f}".format(
+                    model_name,
+                    result["merge"],
+                    result["pad"],
+                    result["pixels"],
+                    result["pixels"] / baseline - 1,
+                    result["psnr"],
+                    result["max_diff"],
+                )
+            )
@@ -0,0 +1,99 @@
+import struct
+import zlib
+from typing import BinaryIO
+
+import numpy as np
+from PIL import Image
+
+
+class PngWriter:
+    """
+    Incremental PNG encoder: rows are filtered and compressed as soon as they are
+    written, so the whole image is never held in memory
+
+    Attributes:
+        file (BinaryIO): output file
+        width (int): image width
+        height (int): image height
+    """
+
+    def __init__(
+        self, file: BinaryIO, width: int, height: int, compress_level: int = 6
+    ):
+        self.file = file
+        self.width = width
+        self.height = height
+        self._rows = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bit RGB, no interlace
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, rows: np.ndarray):
+        """
+        Encode rows
+
+        Args:
+            rows: uint8 array (rows, width, 3)
+        """
+        # sub filter: difference with the previous pixel, compresses photos better
+        filtered = rows.copy()
+        filtered[:, 1:] -= rows[:, :-1]
+        lines = np.empty((len(rows), self.width * 3 + 1), dtype=np.uint8)
+        lines[:, 0] = 1
+        lines[:, 1:] = filtered.reshape(len(rows), -1)
+        data = self._compressor.compress(lines.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self._rows += len(rows)
+
+    def close(self):
+        if self._rows != self.height:
+            raise ValueError(f"{self._rows} rows written, expected {self.height}")
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+
+
+class MemmapWriter:
+    """
+    Rows are written to a disk-backed array. Pillow encodes the image (e.g. to
+    JPEG or TIFF) straight from the file mapping, which is paged out under memory
+    pressure instead of being held by the process.
+
+    Attributes:
+        path (str): path to raw RGB file
+        width (int): image width
+        height (int): image height
+    """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.array = np.memmap(
+            path, dtype=np.uint8, mode="w+", shape=(height, width, 3)
+        )
+        self._rows = 0
+
+    def write(self, rows: np.ndarray):
+        """
+        Write rows
+
+        Args:
+            rows: uint8 array (rows, width, 3)
+        """
+        self.array[self._rows : self._rows + len(rows)] = rows
+        self._rows += len(rows)
+
+    def close(self):
+        self.array.flush()
+
+    def image(self) -> Image:
+        """Image backed by the file mapping"""
+        return Image.frombuffer(
+            "RGB", (self.width, self.height), self.array, "raw", "RGB", 0, 1
+        )
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def weights_fingerprint(spec, precision: str) -> str:
+    """
+    Weights which produce outputs of the model: model class and artifact version,
+    and path, size and modification time of the loaded weights files, so that
+    cached outputs are not served after weights change or the model is
+    calibrated again. A missing int8 file means dynamic int8.
+
+    Args:
+        spec: ModelSpec
+        precision: resolved precision
+    """
+    from src.models.quantization import quantized_weights_file
+    from src.models.weights_io import memory_mapped_file, weights_dtype
+
+    files = [spec.weights_file, memory_mapped_file(spec, weights_dtype(precision))]
+    if precision == "int8":
+        files.append(quantized_weights_file(spec))
+    parts = [spec.artifact_tag]
+    for file in files:
+        if file is None:
+            continue
+        try:
+            stat = os.stat(file)
+            parts.append(f"{file}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{file}:missing")
+    return "|".join(parts)
+
+
+def tile_key(
+    model_name: str, precision: str, backend: str, weights: str, tile: torch.Tensor
+) -> str:
+    """
+    Cache key of tile window: model, precision, backend and hash of weights
+    fingerprint (weights_fingerprint), window shape and bytes
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(weights.encode())
+    digest.update(str(tuple(tile.shape)).encode())
+    digest.update(tile.contiguous().numpy().tobytes())
+    return f"{model_name}.{precision}.{backend}.{digest.hexdigest()}"
+
+
+class TileCache:
+    """
+    Process-wide LRU cache of model outputs for tile windows
+
+    Outputs are stored by tile_key, so identical windows (re-uploaded images,
+    repeated patterns) skip the model. If total size of cached outputs exceeds the
+    memory budget, least recently used outputs are evicted to the disk tier if it is
+    set, and files of the disk tier are removed oldest first. The disk tier can be
+    shared by worker processes.
+
+    Attributes:
+        max_size (int): memory budget in bytes, 0 disables the cache
+        path (str): directory of the disk tier, None disables it
+        max_disk_size (int): disk budget in bytes, 0 means no limit
+        hits (dict): number of outputs served from memory or disk, by model name
+        misses (dict): number of outputs computed by the model, by model name
+        evictions (int): number of outputs evicted from memory
+    """
+
+    def __init__(self, max_size: int = 0, path: str = None, max_disk_size: int = 0):
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+        self.size = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.RLock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".pt")
+
+    def get(self, key: str) -> torch.Tensor:
+        """
+        Cached output of tile window, None on miss
+
+        Args:
+            key: tile_key of the window
+        """
+        model_name = key.split(".", 1)[0]
+        with self._lock:
+            output = self._tiles.get(key)
+            if output is not None:
+                self._tiles.move_to_end(key)
+        if output is None and self.path:
+            output = self._load(key)
+            if output is not None:
+                self.put(key, output)
+        with self._lock:
+            counter = self.misses if output is None else self.hits
+            counter[model_name] = counter.get(model_name, 0) + 1
+        return output
+
+    def put(self, key: str, output: torch.Tensor):
+        """
+        Store output of tile window
+
+        Args:
+            key: tile_key of the window
+            output: model output for the window
+        """
+        size = output.numel() * output.element_size()
+        if size > self.max_size:
+            return
+        evicted = []
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = output
+            self.size += size
+            while self.size > self.max_size:
+                old_key, old_output = self._tiles.popitem(last=False)
+                self.size -= old_output.numel() * old_output.element_size()
+                self.evictions += 1
+                evicted.append((old_key, old_output))
+        if self.path:
+            for old_key, old_output in evicted:
+                self._save(old_key, old_output)
+            if evicted:
+                self._prune()
+
+    def _load(self, key: str) -> torch.Tensor:
+        try:
+            output = torch.load(self._file(key), weights_only=True)
+            # recently used files are kept by _prune
+            os.utime(self._file(key))
+            return output
+        except (OSError, RuntimeError, EOFError):
+            return None
+
+    def _save(self, key: str, output: torch.Tensor):
+        file = self._file(key)
+        if os.path.exists(file):
+            return
+        try:
+            torch.save(output, f"{file}.{os.getpid()}.tmp")
+            os.replace(f"{file}.{os.getpid()}.tmp", file)
+        except OSError:
+            logging.warning(f"Tile {key} not saved to disk cache", exc_info=True)
+
+    def _prune(self):
+        """Remove least recently used files until the disk tier fits the budget"""
+        if self.max_disk_size <= 0:
+            return
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".pt"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        disk_size = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if disk_size <= self.max_disk_size:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                # removed by another worker
+                pass
+            disk_size -= size
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """Cache counters, hit rate by model name"""
+        with self._lock:
+            return {
+                "tiles": len(self._tiles),
+                "size_mb": round(self.size / 1024**2, 1),
+                "evictions": self.evictions,
+                "hit_rate": {
+                    model_name: round(
+                        self.hits.get(model_name, 0)
+                        / (
+                            self.hits.get(model_name, 0)
+                            + self.misses.get(model_name, 0)
+                        ),
+                        3,
+                    )
+                    for model_name in {**self.hits, **self.misses}
+                },
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+
+
+tile_cache = TileCache(
+    max_size=int(os.getenv("TILE_CACHE_SIZE_MB", "0")) * 1024**2,
+    path=os.getenv("TILE_CACHE_DIR"),
+    max_disk_size=int(os.getenv("TILE_CACHE_DISK_MB", "0")) * 1024**2,
+)
@@ -0,0 +1,335 @@
+import math
+import threading
+
+import torch
+
+
+class Tile:
+    """
+    Tile of image processed by Enhancer.tile_process
+
+    Tiles don't overlap and cover the whole image. The network gets a window
+    around the tile, so that the tile has context on every side. Windows are cut
+    by the image border, or for uniform plans have the same size for all tiles:
+    windows of edge tiles are shifted inside the image, so that tiles can be batched.
+    Windows are extended to a multiple of the network's padding multiple where the
+    image allows, the extra pixels are more context instead of padding.
+
+    Attributes:
+        index (int): tile number, starting from 1
+        top (int): tile position on input image
+        left (int): tile position on input image
+        height (int): tile size
+        width (int): tile size
+        window_top (int): window position on input image
+        window_left (int): window position on input image
+        window_height (int): window size
+        window_width (int): window size
+    """
+
+    def __init__(
+        self,
+        index: int,
+        top: int,
+        left: int,
+        height: int,
+        width: int,
+        window_top: int,
+        window_left: int,
+        window_height: int,
+        window_width: int,
+    ):
+        self.index = index
+        self.top = top
+        self.left = left
+        self.height = height
+        self.width = width
+        self.window_top = window_top
+        self.window_left = window_left
+        self.window_height = window_height
+        self.window_width = window_width
+
+    def window(self) -> tuple:
+        """Slices of the window on input image"""
+        return (
+            slice(self.window_top, self.window_top + self.window_height),
+            slice(self.window_left, self.window_left + self.window_width),
+        )
+
+    def area(self, scale: int, top: int = 0) -> tuple:
+        """Slices of the tile on output image, or on its band starting at row top"""
+        return (
+            slice((self.top - top) * scale, (self.top - top + self.height) * scale),
+            slice(self.left * scale, (self.left + self.width) * scale),
+        )
+
+    def window_area(self, scale: int, top: int = 0) -> tuple:
+        """Slices of the window on output image, or on its band starting at row top"""
+        return (
+            slice(
+                (self.window_top - top) * scale,
+                (self.window_top - top + self.window_height) * scale,
+            ),
+            slice(
+                self.window_left * scale, (self.window_left + self.window_width) * scale
+            ),
+        )
+
+    def weights(self, scale: int, pad: int, height: int, width: int) -> torch.Tensor:
+        """
+        Blending weights of the window output. On window sides inside the image the
+        outer pad / 2 pixels, which lack context, get zero weight, and the weight
+        rises linearly over the next pad pixels, so that the ramps of neighbouring
+        windows are centered on the tile border and sum to one. Weights are ones
+        elsewhere.
+
+        Args:
+            scale: upscale factor
+            pad: tile pad, windows of neighbouring tiles overlap by 2 * pad
+            height: image height
+            width: image width
+
+        Returns:
+            tensor (window_height * scale, window_width * scale)
+        """
+        rows = feather(
+            self.window_height * scale,
+            pad * scale,
+            pad // 2 * scale,
+            self.window_top > 0,
+            self.window_top + self.window_height < height,
+        )
+        cols = feather(
+            self.window_width * scale,
+            pad * scale,
+            pad // 2 * scale,
+            self.window_left > 0,
+            self.window_left + self.window_width < width,
+        )
+        return rows[:, None] * cols[None, :]
+
+    def shifted(self, rows: int) -> "Tile":
+        """Same tile on the image cropped from row rows, e.g. on a band of rows"""
+        return Tile(
+            index=self.index,
+            top=self.top - rows,
+            left=self.left,
+            height=self.height,
+            width=self.width,
+            window_top=self.window_top - rows,
+            window_left=self.window_left,
+            window_height=self.window_height,
+            window_width=self.window_width,
+        )
+
+    def crop(self, scale: int) -> tuple:
+        """Slices of the tile on output of the window"""
+        top = (self.top - self.window_top) * scale
+        left = (self.left - self.window_left) * scale
+        return (
+            slice(top, top + self.height * scale),
+            slice(left, left + self.width * scale),
+        )
+
+
+def split_bands(tiles: list) -> list:
+    """
+    Group tiles into bands, rows of tiles with the same top
+
+    Returns:
+        lists of tiles, top to bottom
+    """
+    bands = {}
+    for tile in tiles:
+        bands.setdefault(tile.top, []).append(tile)
+    return list(bands.values())
+
+
+def feather(
+    length: int, ramp: int, margin: int, start: bool, end: bool
+) -> torch.Tensor:
+    """
+    Weights along window side: zeros on margin, then linear ramp from 0 to 1 at
+    start and from 1 to 0 at end
+
+    Args:
+        length: side length
+        ramp: ramp length
+        margin: number of zero weights before ramp
+        start: ramp at start
+        end: ramp at end
+
+    Returns:
+        tensor (length,)
+    """
+    # steps are positive, so that the tile itself always has a weight
+    steps = torch.cat([torch.zeros(margin), (torch.arange(ramp) + 0.5) / ramp])
+    steps = steps[:length]
+    weights = torch.ones(length)
+    if start:
+        weights[: len(steps)] = steps
+    if end:
+        weights[length - len(steps) :] = torch.minimum(
+            weights[length - len(steps) :], steps.flip(0)
+        )
+    return weights
+
+
+def is_flat(window: torch.Tensor, threshold: float) -> bool:
+    """
+    Window is near-uniform: no step between neighbouring pixels exceeds threshold.
+    Smooth backgrounds pass, any edge (e.g. text) or noise doesn't.
+
+    Args:
+        window: tile window (b, c, h, w)
+        threshold: largest step in range [0, 1]
+    """
+    if min(window.shape[-2:]) < 2:
+        return False
+    return (
+        window.diff(dim=-1).abs().max() <= threshold
+        and window.diff(dim=-2).abs().max() <= threshold
+    )
+
+
+def align(start: int, length: int, size: int, multiple: int) -> tuple:
+    """
+    Move window start down to a multiple of multiple and extend its end to a
+    multiple of multiple, keeping it inside the image. Windows start on the same
+    phase as the whole image, so that strided downsampling (SCUNet) and Haar
+    wavelets (MLWNet) see the same pixel grid as without tiling. A window ending
+    at the image border is padded by the network, as the whole image is.
+
+    Args:
+        start: window position
+        length: window size
+        size: image size
+        multiple: alignment
+
+    Returns:
+        aligned position and size
+    """
+    end = min(start + length, size)
+    start -= start % multiple
+    end = min(start + math.ceil((end - start) / multiple) * multiple, size)
+    return start, end - start
+
+
+def plan_tiles(
+    height: int,
+    width: int,
+    tile_size: int,
+    tile_pad: int,
+    uniform: bool = False,
+    multiple: int = 1,
+) -> list:
+    """
+    Split image into tiles
+
+    Args:
+        height: image height
+        width: image width
+        tile_size: tile size
+        tile_pad: context around tile on every side
+        uniform: windows of all tiles have the same size before alignment, which
+            extends some of them by less than multiple
+        multiple: window positions and sizes are aligned to this value
+
+    Returns:
+        list of Tile, row by row
+    """
+    tiles_x = math.ceil(width / tile_size)
+    tiles_y = math.ceil(height / tile_size)
+
+    tiles = []
+    for y in range(tiles_y):
+        for x in range(tiles_x):
+            top = y * tile_size
+            left = x * tile_size
+            tile_height = min(tile_size, height - top)
+            tile_width = min(tile_size, width - left)
+            if uniform:
+                window_height = min(tile_size + 2 * tile_pad, height)
+                window_width = min(tile_size + 2 * tile_pad, width)
+                window_top = min(max(top - tile_pad, 0), height - window_height)
+                window_left = min(max(left - tile_pad, 0), width - window_width)
+            else:
+                window_top = max(top - tile_pad, 0)
+                window_left = max(left - tile_pad, 0)
+                window_height = min(top + tile_height + tile_pad, height) - window_top
+                window_width = min(left + tile_width + tile_pad, width) - window_left
+            window_top, window_height = align(
+                window_top, window_height, height, multiple
+            )
+            window_left, window_width = align(
+                window_left, window_width, width, multiple
+            )
+            tiles.append(
+                Tile(
+                    index=y * tiles_x + x + 1,
+                    top=top,
+                    left=left,
+                    height=tile_height,
+                    width=tile_width,
+                    window_top=window_top,
+                    window_left=window_left,
+                    window_height=window_height,
+                    window_width=window_width,
+                )
+            )
+    return tiles
+
+
+def window_sides(
+    tile_size: int, tile_pad: int, uniform: bool = False, multiple: int = 1
+) -> list:
+    """
+    Sides of aligned windows of plan_tiles, except windows at the image end, whose
+    sides depend on the image size. Aligned sides of inner windows depend on the
+    tile position modulo multiple, so a plan long enough to cover every position
+    is taken.
+
+    Args:
+        tile_size: tile size
+        tile_pad: context around tile on every side
+        uniform: windows of all tiles have the same size
+        multiple: window positions and sizes are aligned to this value
+
+    Returns:
+        sorted list of window sides
+    """
+    period = multiple // math.gcd(tile_size, multiple)
+    tiles = plan_tiles(
+        1, (period + 2) * tile_size, tile_size, tile_pad, uniform, multiple
+    )
+    return sorted({tile.window_width for tile in tiles[:-1]})
+
+
+class BufferPool:
+    """
+    Reusable tensors for batches of tile windows, so that windows are copied into
+    preallocated memory instead of allocating it for every batch
+
+    Attributes:
+        dtype (torch.dtype): dtype of buffers
+        pin_memory (bool): allocate page-locked memory for faster copies to cuda
+    """
+
+    def __init__(self, dtype: torch.dtype = torch.float32, pin_memory: bool = False):
+        self.dtype = dtype
+        self.pin_memory = pin_memory
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def get(self, shape: tuple) -> torch.Tensor:
+        """Free buffer of given shape, allocated if there is no such buffer"""
+        with self._lock:
+            free = self._free.get(tuple(shape))
+            if free:
+                return free.pop()
+        return torch.empty(shape, dtype=self.dtype, pin_memory=self.pin_memory)
+
+    def release(self, buffer: torch.Tensor):
+        """Return buffer to the pool"""
+        with self._lock:
+            self._free.setdefault(tuple(buffer.shape), []).append(buffer)
@@ -0,0 +1,97 @@
+import logging
+import os
+import time
+
+import torch
+
+from src.models.image_enhance import Enhancer
+from src.models.registry import load_registry
+from src.models.tiling import window_sides
+
+
+def warmup_shapes(
+    tile_size: int, tile_pad: int, batch_size: int = 1, multiple: int = 1
+) -> list:
+    """
+    Typical batches of tile windows produced by Enhancer.tile_process
+
+    Args:
+        tile_size: tile size
+        tile_pad: pad size for tile
+        batch_size: number of tiles in one forward
+        multiple: windows are aligned to this value
+
+    Returns:
+        list of (batch, height, width): windows with the smallest and the largest
+        aligned sides, e.g. of the first tile and of interior tiles
+    """
+    sides = window_sides(tile_size, tile_pad, batch_size > 1, multiple)
+    sides = list(dict.fromkeys([sides[0], sides[-1]]))
+    return [(batch_size, height, width) for height in sides for width in sides]
+
+
+def get_warmup_models() -> list:
+    """
+    Models for warmup from WARMUP_MODELS (comma-separated), by default all models
+    whose weights are present
+    """
+    models = os.getenv("WARMUP_MODELS")
+    if models is None:
+        return [name for name, spec in load_registry().items() if spec.available]
+    return [model.strip() for model in models.split(",") if model.strip()]
+
+
+def warmup(model_names: list):
+    """
+    Load models into the model cache and run forwards on typical tile shapes,
+    so that the first jobs don't pay for weight loading and kernel initialization.
+    Models which fail are logged and skipped, so that the worker still starts.
+
+    Args:
+        model_names: models for warmup
+    """
+    for model_name in model_names:
+        try:
+            warmup_model(model_name)
+        except Exception:
+            logging.error(f"Warmup of {model_name} failed", exc_info=True)
+
+
+@torch.no_grad()
+def warmup_model(model_name: str):
+    """Load model and run forwards on typical tile shapes"""
+    start = time.perf_counter()
+    enhancer = Enhancer(model_name=model_name)
+    enhancer.load_model()
+    if hasattr(enhancer.model, "shapes"):
+        # compiled model: compile every bucket for batches of tiles
+        shapes = [
+            (enhancer.tile_batch_size, height, width)
+            for height, width in enhancer.model.shapes
+        ]
+    elif enhancer.tile_size > 0:
+        shapes = warmup_shapes(
+            enhancer.tile_size,
+            enhancer.tile_pad,
+            enhancer.tile_batch_size,
+            enhancer.tile_multiple,
+        )
+    else:
+        shapes = [(1, 256, 256)]
+    for batch, height, width in shapes:
+        enhancer.inference(torch.rand(batch, 3, height, width))
+    logging.info(
+        f"Warmup {model_name} on {shapes}: {time.perf_counter() - start:.2f} s"
+    )
+
+
+def set_ready(ready: bool):
+    """
+    Create or remove readiness marker for the container healthcheck
+    """
+    ready_file = os.getenv("READY_FILE", "/tmp/worker_ready")
+    if ready:
+        with open(ready_file, "w") as f:
+            f.write(str(os.getpid()))
+    elif os.path.exists(ready_file):
+        os.remove(ready_file)
@@ -0,0 +1,118 @@
+# python -m src.models.weights_io --dtype fp32 bf16
+import argparse
+import logging
+import os
+import time
+
+import torch
+
+from src.models.registry import ModelSpec, get_spec, model_names
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def converted_weights_file(spec: ModelSpec, dtype: str) -> str:
+    """
+    Path to converted weights, e.g. weights/RealESRGAN_x2plus.bf16.pt
+    """
+    root, _ = os.path.splitext(spec.weights_file)
+    return f"{root}.{dtype}.pt"
+
+
+def weights_dtype(precision: str) -> str:
+    """
+    Dtype of stored weights preferred for precision
+    """
+    return precision if precision in ("fp16", "bf16") else "fp32"
+
+
+def memory_mapped_file(spec: ModelSpec, dtype: str = "fp32") -> str:
+    """
+    Converted weights which will be loaded for dtype, None if there are no
+    converted weights. Weights in the requested dtype are preferred, then fp32.
+    """
+    for candidate in dict.fromkeys([dtype, "fp32"]):
+        path = converted_weights_file(spec, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_checkpoint(spec: ModelSpec) -> dict:
+    """
+    Load state dict from original checkpoint
+    """
+    state_dict = torch.load(spec.weights_file, map_location="cpu", weights_only=True)
+    if spec.state_dict_key is not None:
+        state_dict = state_dict[spec.state_dict_key]
+    return state_dict
+
+
+def load_state_dict(spec: ModelSpec, dtype: str = "fp32") -> dict:
+    """
+    Load model weights. Converted weights are memory-mapped, so they are read
+    lazily and shared between worker processes through the page cache.
+    Weights in the requested dtype are preferred, then fp32 converted weights,
+    then the original checkpoint.
+
+    Args:
+        spec: model description
+        dtype: preferred weights dtype, fp32, fp16 or bf16
+
+    Returns:
+        state dict
+    """
+    path = memory_mapped_file(spec, dtype)
+    if path is not None:
+        logging.info(f"Load weights {path}")
+        return torch.load(path, map_location="cpu", weights_only=True, mmap=True)
+    return load_checkpoint(spec)
+
+
+def convert(spec: ModelSpec, dtype: str = "fp32") -> str:
+    """
+    Convert original checkpoint into plain state dict of the given dtype
+    which can be loaded with torch.load(mmap=True)
+
+    Returns:
+        path to converted weights
+    """
+    state_dict = {
+        name: tensor.to(DTYPES[dtype]) if tensor.is_floating_point() else tensor
+        for name, tensor in load_checkpoint(spec).items()
+    }
+    path = converted_weights_file(spec, dtype)
+    torch.save(state_dict, path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert checkpoints into memory-mapped format"
+    )
+    parser.add_argument("models", nargs="*", default=None)
+    parser.add_argument("--dtype", nargs="+", default=["fp32"], choices=list(DTYPES))
+    args = parser.parse_args()
+
+    for model_name in args.models or model_names():
+        spec = get_spec(model_name)
+        if not spec.available:
+            print(f"{model_name}: weights not found")
+            continue
+        start = time.perf_counter()
+        load_checkpoint(spec)
+        checkpoint_time = time.perf_counter() - start
+        for dtype in args.dtype:
+            path = convert(spec, dtype)
+            start = time.perf_counter()
+            load_state_dict(spec, dtype)
+            print(
+                "{:<16} {:<5} {:>8.1f} MB  load {:.3f} s -> {:.3f} s  {}".format(
+                    model_name,
+                    dtype,
+                    os.path.getsize(path) / 1024**2,
+                    checkpoint_time,
+                    time.perf_counter() - start,
+                    path,
+                )
+            )
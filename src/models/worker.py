@@ -1,46 +1,170 @@
+import io
+import json
 import logging
 import os
 import pickle
 
 import pika
 import redis
+import torch
 from pika import BasicProperties, PlainCredentials
+from PIL import Image
 
+from src.models.checkpoint import get_checkpoint
+from src.models.distributed import (
+    claim_gather,
+    gather,
+    part_done,
+    plan_parts,
+    process_part,
+    save_part,
+    should_distribute,
+)
 from src.models.image_enhance import Enhancer
+from src.models.model_cache import model_cache
+from src.models.registry import describe, get_spec
+from src.models.stream_writer import PngWriter
+from src.models.tile_cache import tile_cache
+from src.models.warmup import get_warmup_models, set_ready, warmup
+from src.models.worker_pool import run_pool, threads_per_process
+
+# larger outputs are encoded to PNG band by band instead of building the whole image
+STREAM_OUTPUT_PIXELS = int(os.getenv("STREAM_OUTPUT_PIXELS", "16000000"))
+
+
+def enhance(model_name: str, img: Image, checkpoint=None):
+    """
+    Enhance image, checkpointed images are processed band by band
+
+    Returns:
+        PIL image, or PNG bytes for outputs larger than STREAM_OUTPUT_PIXELS or
+        checkpointed images
+    """
+    scale = get_spec(model_name).scale
+    width, height = img.width * scale, img.height * scale
+    if width * height <= STREAM_OUTPUT_PIXELS and checkpoint is None:
+        return Enhancer(model_name=model_name).enhance(img)
+    file = io.BytesIO()
+    writer = PngWriter(file, width, height)
+    Enhancer(model_name=model_name).enhance_stream(img, writer, checkpoint)
+    writer.close()
+    return file.getvalue()
+
+
+def distribute(ch, model_name: str, inference_id: str, img: Image):
+    """
+    Publish bands of tiles of image to inference_queue as parts of the task
+    """
+    parts = plan_parts(model_name, img)
+    for part in parts:
+        ch.basic_publish(
+            exchange="",  # default exchange
+            routing_key="inference_queue",
+            body=pickle.dumps(part),
+            properties=BasicProperties(
+                headers={
+                    "inference_id": inference_id,
+                    "model": model_name,
+                    "part": part["index"],
+                    "parts": len(parts),
+                    "width": img.width * get_spec(model_name).scale,
+                    "height": img.height * get_spec(model_name).scale,
+                }
+            ),
+        )
+    logging.info(f"Task {inference_id} split into {len(parts)} parts")
+
+
+def process(headers: dict, part: dict):
+    """
+    Process part of task, the worker saving the last part gathers the result
+    """
+    inference_id = headers["inference_id"]
+    if part_done(redis_client, inference_id, headers["part"]):
+        logging.info(f"Part {headers['part']} of {inference_id} is already done")
+    else:
+        rows = process_part(headers["model"], part)
+        save_part(redis_client, inference_id, headers["part"], rows)
+    if claim_gather(redis_client, inference_id, headers["parts"]):
+        # the result is saved by gather
+        gather(
+            redis_client,
+            inference_id,
+            headers["parts"],
+            headers["width"],
+            headers["height"],
+        )
 
 
 def callback(ch, method, properties: BasicProperties, body):
     """Function for image processing"""
-    image_data = pickle.loads(body)
+    headers = properties.headers
+    data = pickle.loads(body)
     try:
-        result = Enhancer(model_name=properties.headers["model"]).enhance(image_data)
-        redis_client.set(properties.headers["inference_id"], pickle.dumps(result))
+        if "part" in headers:
+            process(headers, data)
+        elif should_distribute(headers["model"], data):
+            distribute(ch, headers["model"], headers["inference_id"], data)
+        else:
+            # redelivered tasks resume from completed bands
+            checkpoint = get_checkpoint(headers["inference_id"], redis_client)
+            try:
+                result = enhance(headers["model"], data, checkpoint)
+                redis_client.set(headers["inference_id"], pickle.dumps(result))
+            finally:
+                if checkpoint:
+                    checkpoint.clear()
     except Exception:
-        redis_client.set(properties.headers["inference_id"], "error")
+        logging.error("Processing error", exc_info=True)
+        redis_client.set(headers["inference_id"], "error")
+    logging.info(f"Model cache: {model_cache.stats()}")
+    if tile_cache.enabled:
+        logging.info(f"Tile cache: {tile_cache.stats()}")
 
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
-logging.basicConfig(level=logging.INFO)
+def consume():
+    """Connect to RabbitMQ and Redis and process tasks from inference_queue"""
+    global redis_client
 
-# define rabbitmq and redis client
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(
-        heartbeat=0,
-        host="rabbit",
-        port=5672,
-        credentials=PlainCredentials(
-            os.getenv("RABBITMQ_DEFAULT_USER"), os.getenv("RABBITMQ_DEFAULT_PASS")
-        ),
+    # define rabbitmq and redis client
+    connection = pika.BlockingConnection(
+        pika.ConnectionParameters(
+            heartbeat=0,
+            host="rabbit",
+            port=5672,
+            credentials=PlainCredentials(
+                os.getenv("RABBITMQ_DEFAULT_USER"), os.getenv("RABBITMQ_DEFAULT_PASS")
+            ),
+        )
     )
-)
-rabbitmq_client = connection.channel()
-rabbitmq_client.queue_declare(queue="inference_queue")
+    rabbitmq_client = connection.channel()
+    rabbitmq_client.queue_declare(queue="inference_queue")
+
+    redis_client = redis.Redis(host="redis", port=6379)
+
+    # start rabbitmq
+    rabbitmq_client.basic_qos(prefetch_count=1)
+    rabbitmq_client.basic_consume(queue="inference_queue", on_message_callback=callback)
+    set_ready(True)
+
+    rabbitmq_client.start_consuming()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    num_processes = int(os.getenv("WORKER_PROCESSES", "1"))
 
-redis_client = redis.Redis(host="redis", port=6379)
+    # warmup models before consuming tasks
+    set_ready(False)
+    torch.set_num_threads(threads_per_process(1))
+    warmup(get_warmup_models())
 
-# start rabbitmq
-rabbitmq_client.basic_qos(prefetch_count=1)
-rabbitmq_client.basic_consume(queue="inference_queue", on_message_callback=callback)
+    # publish served models for model selection in API
+    redis.Redis(host="redis", port=6379).set("model_registry", json.dumps(describe()))
 
-rabbitmq_client.start_consuming()
+    if num_processes > 1:
+        run_pool(consume, num_processes)
+    else:
+        consume()
@@ -0,0 +1,121 @@
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import sys
+from multiprocessing.connection import wait
+from typing import Callable
+
+import torch
+
+from src.models.model_cache import model_cache
+from src.models.registry import get_spec
+from src.models.weights_io import memory_mapped_file, weights_dtype
+
+
+def cpu_quota() -> float:
+    """
+    Number of CPUs available to the container: cgroup CPU quota,
+    or CPU affinity of the process if there is no quota
+    """
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, int(quota) / int(period))
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                cpus = min(cpus, quota / period)
+        except (OSError, ValueError):
+            pass
+    return cpus
+
+
+def threads_per_process(num_processes: int) -> int:
+    """
+    Intra-op threads for each of num_processes, so that processes don't oversubscribe CPUs
+    """
+    return max(1, math.floor(cpu_quota() / num_processes))
+
+
+def share_models():
+    """
+    Move weights of cached cpu models into shared memory before fork.
+    Memory-mapped weights are already shared through the page cache.
+    """
+    for (model_name, device, precision, _), model in model_cache.items():
+        if device != "cpu":
+            continue
+        if memory_mapped_file(get_spec(model_name), weights_dtype(precision)):
+            continue
+        model.share_memory()
+
+
+def run_pool(target: Callable, num_processes: int):
+    """
+    Fork num_processes processes running target after models are loaded
+    and restart them if they exit
+
+    Forked processes can't use CUDA initialized by the parent, so if models are
+    loaded to cuda, target runs in this process instead, with a warning.
+
+    Args:
+        target: function run by every process
+        num_processes: number of processes
+    """
+    if torch.cuda.is_initialized():
+        logging.warning(
+            "CUDA is initialized before fork, running 1 process "
+            f"instead of {num_processes}"
+        )
+        target()
+        return
+
+    share_models()
+    num_threads = threads_per_process(num_processes)
+    context = multiprocessing.get_context("fork")
+
+    def start(index: int):
+        process = context.Process(
+            target=_run, args=(target, num_threads), name=f"worker-{index}"
+        )
+        process.start()
+        logging.info(
+            f"Started {process.name} (pid {process.pid}, {num_threads} threads)"
+        )
+        return process
+
+    processes = [start(index) for index in range(num_processes)]
+
+    def stop(signum, frame):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while True:
+        wait([process.sentinel for process in processes])
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                logging.error(f"{process.name} exited with code {process.exitcode}")
+                processes[index] = start(index)
+
+
+def _run(target: Callable, num_threads: int):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(num_threads)
+    target()
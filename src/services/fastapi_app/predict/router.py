@@ -1,5 +1,6 @@
 import asyncio
 import io
+import json
 import logging
 import os
 import pickle
@@ -31,6 +32,28 @@ rabbitmq_client.queue_declare(queue="inference_queue")
 redis_client = redis.Redis(host="redis", port=6379)
 
 
+def find_model(task: str, scale: int = 1) -> str:
+    """
+    Find model for the task in the model registry published by worker
+
+    Args:
+        task: upscale, deblur or denoise
+        scale: upscaling factor
+
+    Returns:
+        model name, raises HTTPException if model not found
+    """
+    registry = redis_client.get("model_registry")
+    if registry is None:
+        raise HTTPException(status_code=503, detail="No models available")
+    for model_name, model in json.loads(registry).items():
+        if model["task"] == task and model["scale"] == scale:
+            return model_name
+    if task == "upscale":
+        raise HTTPException(status_code=400, detail="Invalid scale")
+    raise HTTPException(status_code=503, detail="Model not available")
+
+
 @router.post("/upscale")
 async def upscale(scale: int = 2, image: UploadFile = None):
     """
@@ -44,6 +67,7 @@ async def upscale(scale: int = 2, image: UploadFile = None):
         status code 200 and inference_id - if all is ok
         status code 400 - if something wrong with file or invalid scale
         status code 500 - if something wrong while sending task
+        status code 503 - if model is not available
     """
     try:
         content = image.file.read()
@@ -53,14 +77,8 @@ async def upscale(scale: int = 2, image: UploadFile = None):
         logging.error("Files read error", exc_info=True)
         raise HTTPException(status_code=400, detail="Something wrong with file")
 
-    if scale == 2:
-        logging.info("Upscale x2")
-        model_name = "real_esrgan_x2"
-    elif scale == 4:
-        logging.info("Upscale x4")
-        model_name = "real_esrgan_x4"
-    else:
-        raise HTTPException(status_code=400, detail="Invalid scale")
+    model_name = find_model("upscale", scale)
+    logging.info(f"Upscale x{scale}")
 
     try:
         inference_id = str(uuid.uuid4())
@@ -92,6 +110,7 @@ async def deblur(image: UploadFile = None):
         status code 200 and inference_id - if all is ok
         status code 400 - if something wrong with file
         status code 500 - if something wrong while sending task
+        status code 503 - if model is not available
     """
     try:
         content = image.file.read()
@@ -101,6 +120,7 @@ async def deblur(image: UploadFile = None):
         logging.error("Files read error", exc_info=True)
         raise HTTPException(status_code=400, detail="Something wrong with file")
 
+    model_name = find_model("deblur")
     try:
         logging.info("Deblur image")
         inference_id = str(uuid.uuid4())
@@ -110,7 +130,7 @@ async def deblur(image: UploadFile = None):
             routing_key="inference_queue",
             body=pickle.dumps(img),
             properties=BasicProperties(
-                headers={"inference_id": inference_id, "model": "mlwnet"}
+                headers={"inference_id": inference_id, "model": model_name}
             ),
         )
     except Exception:
@@ -132,6 +152,7 @@ async def denoise(image: UploadFile = None):
         status code 200 and inference_id - if all is ok
         status code 400 - if something wrong with file
         status code 500 - if something wrong while sending task
+        status code 503 - if model is not available
     """
     try:
         img = Image.open(image.file)
@@ -139,6 +160,7 @@ async def denoise(image: UploadFile = None):
         logging.error("Files read error", exc_info=True)
         raise HTTPException(status_code=400, detail="Something wrong with file")
 
+    model_name = find_model("denoise")
     try:
         logging.info("Denoise image")
         inference_id = str(uuid.uuid4())
@@ -148,7 +170,7 @@ async def denoise(image: UploadFile = None):
             routing_key="inference_queue",
             body=pickle.dumps(img),
             properties=BasicProperties(
-                headers={"inference_id": inference_id, "model": "scunet"}
+                headers={"inference_id": inference_id, "model": model_name}
             ),
         )
     except Exception:
@@ -180,6 +202,9 @@ async def classification_result(inference_id) -> Response:
                     status_code=500, detail="Something wrong while image processing"
                 )
             img = pickle.loads(result)
+            # large images are already encoded to png by the worker
+            if isinstance(img, bytes):
+                return Response(content=img, media_type="image/png")
             img_bytes = io.BytesIO()
             img.save(img_bytes, format="png")
             img_bytes = img_bytes.getvalue()
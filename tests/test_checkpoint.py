@@ -0,0 +1,28 @@
+import numpy as np
+
+from src.models.checkpoint import DirCheckpoint, resume
+
+
+def test_checkpoint_of_another_plan_is_discarded(tmp_path):
+    checkpoint = DirCheckpoint(str(tmp_path), "task")
+    state = resume(checkpoint, ("scunet", 64, 16))
+    rows = np.zeros((4, 8, 3), dtype=np.uint8)
+    checkpoint.save(0, rows)
+    checkpoint.save_state({**state, "index": 0})
+
+    # redelivered task with the same plan resumes
+    checkpoint = DirCheckpoint(str(tmp_path), "task")
+    assert resume(checkpoint, ("scunet", 64, 16))["index"] == 0
+    assert np.array_equal(checkpoint.load(0), rows)
+
+    # bands of another tile size aren't reused
+    assert resume(checkpoint, ("scunet", 128, 16)) == {"plan": ("scunet", 128, 16)}
+    assert checkpoint.load(0) is None
+    assert checkpoint.load_state() == {"plan": ("scunet", 128, 16)}
+
+
+def test_checkpoint_without_plan_is_discarded(tmp_path):
+    checkpoint = DirCheckpoint(str(tmp_path), "task")
+    checkpoint.save(0, np.zeros((4, 8, 3), dtype=np.uint8))
+    resume(checkpoint, ("scunet", 64, 16))
+    assert checkpoint.load(0) is None
@@ -0,0 +1,106 @@
+import pickle
+import time
+
+import numpy as np
+import pytest
+
+from src.models import distributed
+
+
+class FakeRedis:
+    """Commands of redis used by distributed, with key expiry"""
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def _alive(self, key):
+        if key in self.expiry and self.expiry[key] <= time.monotonic():
+            self.values.pop(key, None)
+            self.expiry.pop(key)
+        return key in self.values
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and self._alive(key):
+            return None
+        self.values[key] = value
+        if ex is not None:
+            self.expiry[key] = time.monotonic() + ex
+        return True
+
+    def get(self, key):
+        return self.values.get(key) if self._alive(key) else None
+
+    def exists(self, key):
+        return int(self._alive(key))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.expiry.pop(key, None)
+
+    def sadd(self, key, value):
+        self.values.setdefault(key, set()).add(value)
+
+    def sismember(self, key, value):
+        return self._alive(key) and value in self.values[key]
+
+    def scard(self, key):
+        return len(self.values[key]) if self._alive(key) else 0
+
+    def expire(self, key, seconds):
+        self.expiry[key] = time.monotonic() + seconds
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        for name, args, kwargs in self.commands:
+            getattr(self.redis_client, name)(*args, **kwargs)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    monkeypatch.setattr(distributed, "GATHER_TTL", 0.2)
+    monkeypatch.setattr(distributed, "GATHER_POLL_INTERVAL", 0.01)
+    redis_client = FakeRedis()
+    for index in range(2):
+        rows = np.full((2, 4, 3), index, dtype=np.uint8)
+        distributed.save_part(redis_client, "task", index, rows)
+    return redis_client
+
+
+def test_parts_are_gathered_once(redis_client):
+    assert distributed.claim_gather(redis_client, "task", 2)
+    result = distributed.gather(redis_client, "task", 2, 4, 4)
+    assert pickle.loads(redis_client.get("task")) == result
+    # redelivered part after the gather
+    assert not distributed.claim_gather(redis_client, "task", 2)
+
+
+def test_claim_of_crashed_worker_expires(redis_client):
+    assert distributed.claim_gather(redis_client, "task", 2)
+    # the worker crashed, its redelivered part waits for the claim to expire
+    start = time.monotonic()
+    assert distributed.claim_gather(redis_client, "task", 2)
+    assert time.monotonic() - start >= 0.1
+    distributed.gather(redis_client, "task", 2, 4, 4)
+    assert redis_client.exists("task")
+
+
+def test_failed_gather_releases_claim(redis_client):
+    assert distributed.claim_gather(redis_client, "task", 2)
+    redis_client.delete(distributed.part_key("task", 1))
+    with pytest.raises(TypeError):
+        distributed.gather(redis_client, "task", 2, 4, 4)
+    assert not redis_client.exists(distributed.gather_key("task"))
+    assert not redis_client.exists("task")
@@ -0,0 +1,15 @@
+import pytest
+
+from src.models import receptive_field
+from src.models.image_enhance import Enhancer
+from src.models.registry import get_spec
+
+
+@pytest.mark.parametrize(
+    "auto, tile_pad, expected",
+    [(0, 0, 64), (0, 100, 100), (32, 16, 64), (640, 16, 640)],
+)
+def test_auto_tile_size_keeps_tiling(monkeypatch, auto, tile_pad, expected):
+    monkeypatch.setattr(receptive_field, "auto_tile_size", lambda *args: auto)
+    enhancer = Enhancer("scunet", tile_pad=tile_pad, tile_batch_size=1, device="cpu")
+    assert enhancer.choose_tile_size(get_spec("scunet")) == expected
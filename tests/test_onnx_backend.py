@@ -0,0 +1,78 @@
+import glob
+import os
+
+import pytest
+import torch
+
+pytest.importorskip("onnxruntime")
+
+from src.models.onnx_backend import OrtModel, onnx_file  # noqa: E402
+from src.models.real_esrgan.generator import RRDBNet, RRDBNetInference  # noqa: E402
+from src.models.registry import ModelSpec  # noqa: E402
+
+
+def make_spec(
+    tmp_path,
+    scale: int,
+    class_path: str = "src.models.real_esrgan.generator.RRDBNetInference",
+) -> ModelSpec:
+    return ModelSpec(
+        f"rrdbnet_x{scale}",
+        {
+            "class_path": class_path,
+            "task": "upscale",
+            "scale": scale,
+            "tile_size": 64,
+            "tile_pad": 8,
+            "pre_pad": 0,
+            "pad_multiple": 2 if scale == 2 else 1,
+            "weights_path": str(tmp_path / f"rrdbnet_x{scale}.pth"),
+        },
+    )
+
+
+@pytest.mark.parametrize("scale", [2, 4])
+def test_rrdbnet_inference_exports_to_onnx(tmp_path, scale):
+    torch.manual_seed(0)
+    params = dict(num_in_ch=3, num_out_ch=3, scale=scale, num_feat=8, num_block=2)
+    params["num_grow_ch"] = 4
+    original = RRDBNet(**params).eval()
+    model = RRDBNetInference(**params)
+    model.load_state_dict(original.state_dict())
+    model.eval()
+
+    ort_model = OrtModel(model, make_spec(tmp_path, scale), torch.device("cpu"))
+    assert ort_model.dynamic
+
+    x = torch.rand(1, 3, 24, 40)
+    with torch.no_grad():
+        reference = original(x)
+    assert torch.allclose(ort_model(x), reference, atol=1e-3)
+
+
+def test_graphs_are_named_by_model_class(tmp_path):
+    inference = make_spec(tmp_path, 4)
+    original = make_spec(tmp_path, 4, "src.models.real_esrgan.generator.RRDBNet")
+    assert onnx_file(inference) != onnx_file(original)
+    assert onnx_file(inference, (64, 64)) != onnx_file(original, (64, 64))
+
+
+def test_static_graphs_are_capped(tmp_path):
+    torch.manual_seed(0)
+    params = dict(num_in_ch=3, num_out_ch=3, scale=4, num_feat=8, num_block=1)
+    model = RRDBNetInference(num_grow_ch=4, **params).eval()
+    spec = make_spec(tmp_path, 4)
+    ort_model = OrtModel(model, spec, torch.device("cpu"), max_static_graphs=2)
+    # as if the dynamic graph gave wrong results
+    ort_model.dynamic = False
+    ort_model.model = model
+
+    for size in (16, 20, 24, 28):
+        x = torch.rand(1, 3, size, size)
+        with torch.no_grad():
+            assert torch.allclose(ort_model(x), model(x), atol=1e-3)
+    assert len(ort_model._sessions) == 2
+    assert sorted(os.path.basename(path) for path in ort_model._sessions) == sorted(
+        os.path.basename(path)
+        for path in glob.glob(str(tmp_path / "*.[0-9]*x[0-9]*.onnx"))
+    )
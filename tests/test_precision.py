@@ -0,0 +1,32 @@
+import json
+
+import pytest
+import torch
+
+from src.models import precision
+
+
+@pytest.mark.parametrize(
+    "flags, expected",
+    [({"avx512f", "avx512_bf16"}, True), ({"amx_bf16"}, True), ({"avx512f"}, False)],
+)
+def test_bf16_needs_native_instructions(monkeypatch, flags, expected):
+    monkeypatch.setattr(precision, "cpu_flags", lambda: frozenset(flags))
+    monkeypatch.setattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", lambda: True)
+    assert precision.supported("bf16", torch.device("cpu")) is expected
+
+
+def test_auto_precision_falls_back_to_fp32(monkeypatch, tmp_path):
+    cache = tmp_path / "precision_cache.json"
+    monkeypatch.setattr(precision, "PRECISION_CACHE", str(cache))
+
+    def build(candidate):
+        raise RuntimeError(f"{candidate} failed")
+
+    assert precision.select_precision("scunet", torch.device("cpu"), build) == "fp32"
+    assert not cache.exists()
+
+    cache.write_text(json.dumps({}))
+    monkeypatch.setattr(precision, "benchmark", lambda model, *args: 1.0)
+    assert precision.select_precision("scunet", torch.device("cpu"), str) == "fp32"
+    assert "fp32" in json.loads(cache.read_text()).values()
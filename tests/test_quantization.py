@@ -0,0 +1,43 @@
+import torch
+
+from src.models.quantization import load_quantized_state, quantized_weights_file
+from src.models.registry import ModelSpec
+
+
+def make_spec(tmp_path, class_path: str) -> ModelSpec:
+    return ModelSpec(
+        "real_esrgan_x4",
+        {
+            "class_path": class_path,
+            "task": "upscale",
+            "scale": 4,
+            "tile_size": 64,
+            "tile_pad": 8,
+            "pre_pad": 0,
+            "weights_path": str(tmp_path / "RealESRGAN_x4plus.pth"),
+        },
+    )
+
+
+def test_artifacts_are_named_by_model_class(tmp_path):
+    inference = make_spec(tmp_path, "src.models.real_esrgan.generator.RRDBNetInference")
+    original = make_spec(tmp_path, "src.models.real_esrgan.generator.RRDBNet")
+    assert quantized_weights_file(inference) != quantized_weights_file(original)
+
+
+def test_stale_quantized_weights_are_ignored(tmp_path):
+    spec = make_spec(tmp_path, "src.models.real_esrgan.generator.RRDBNetInference")
+    assert load_quantized_state(spec) is None
+
+    state_dict = {"weight": torch.ones(1)}
+    torch.save(
+        {"artifact": "RRDBNetInference-v0", "state_dict": state_dict},
+        quantized_weights_file(spec),
+    )
+    assert load_quantized_state(spec) is None
+
+    torch.save(
+        {"artifact": spec.artifact_tag, "state_dict": state_dict},
+        quantized_weights_file(spec),
+    )
+    assert load_quantized_state(spec)["weight"].item() == 1
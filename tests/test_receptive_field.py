@@ -0,0 +1,21 @@
+import torch
+
+from src.models import receptive_field
+from src.models.registry import get_spec
+
+
+def test_cpu_memory_is_shared_by_worker_processes(monkeypatch):
+    profile = {"memory": {"fp32": {"base": 0, "per_pixel": 1000}}}
+    monkeypatch.setattr(receptive_field, "load_profile", lambda *args: profile)
+    monkeypatch.setattr(receptive_field, "available_memory", lambda device: 2**33)
+    spec = get_spec("real_esrgan_x4")
+
+    def tile_size(device: str, processes: int) -> int:
+        monkeypatch.setattr(receptive_field, "WORKER_PROCESSES", processes)
+        return receptive_field.auto_tile_size(spec, "fp32", torch.device(device), 0)
+
+    single = tile_size("cpu", 1)
+    # a quarter of memory for each of 4 processes, half the tile side
+    assert abs(tile_size("cpu", 4) - single // 2) <= 8
+    # cuda workers run in one process
+    assert tile_size("cuda", 4) == single
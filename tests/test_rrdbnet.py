@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from src.models.real_esrgan.generator import RRDBNet, RRDBNetInference
+
+PARAMS = dict(num_in_ch=3, num_out_ch=3, num_feat=8, num_block=2, num_grow_ch=4)
+
+
+def make_models(scale: int) -> tuple:
+    torch.manual_seed(0)
+    original = RRDBNet(scale=scale, **PARAMS).eval()
+    model = RRDBNetInference(scale=scale, **PARAMS)
+    model.load_state_dict(original.state_dict(), strict=True)
+    return original, model.eval()
+
+
+@pytest.mark.parametrize("scale", [1, 2, 4])
+def test_inference_matches_rrdbnet(scale):
+    original, model = make_models(scale)
+    x = torch.rand(1, 3, 24, 40)
+    with torch.no_grad():
+        assert torch.allclose(model(x), original(x), atol=1e-5)
+
+
+def test_state_dict_round_trip_is_not_folded_again():
+    original, model = make_models(4)
+    x = torch.rand(1, 3, 24, 40)
+    with torch.no_grad():
+        reference = original(x)
+
+        copy = RRDBNetInference(scale=4, **PARAMS).eval()
+        copy.load_state_dict(model.state_dict(), strict=True)
+        assert torch.allclose(copy(x), reference, atol=1e-5)
+
+        # loading into itself and then the original weights again
+        model.load_state_dict(model.state_dict(), strict=True)
+        assert torch.allclose(model(x), reference, atol=1e-5)
+        model.load_state_dict(original.state_dict(), strict=True)
+        assert torch.allclose(model(x), reference, atol=1e-5)
@@ -0,0 +1,26 @@
+import pytest
+import torch
+
+from src.models.scunet.model import SCUNet
+from src.models.scunet_benchmark import configure
+
+# reference: einsum attention with bias and masks rebuilt on every forward
+EINSUM = {"backend": "einsum", "precompute": False}
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return SCUNet(dim=64, config=[1, 1, 1, 1, 1, 1, 1]).eval()
+
+
+@pytest.mark.parametrize("max_attention_memory", [0, 64 * 1024])
+@pytest.mark.parametrize("size", [(64, 64), (72, 136)])
+def test_sdpa_matches_einsum(model, size, max_attention_memory):
+    x = torch.rand(1, 3, *size)
+    with torch.no_grad():
+        with configure(**EINSUM):
+            reference = model(x)
+        with configure(backend="sdpa", max_attention_memory=max_attention_memory):
+            output = model(x)
+    assert torch.allclose(output, reference, atol=1e-5)
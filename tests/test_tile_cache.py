@@ -0,0 +1,45 @@
+import os
+
+import torch
+
+from src.models.quantization import quantized_weights_file
+from src.models.registry import ModelSpec
+from src.models.tile_cache import tile_key, weights_fingerprint
+
+
+def make_spec(tmp_path) -> ModelSpec:
+    return ModelSpec(
+        "real_esrgan_x4",
+        {
+            "class_path": "src.models.real_esrgan.generator.RRDBNetInference",
+            "task": "upscale",
+            "scale": 4,
+            "tile_size": 64,
+            "tile_pad": 8,
+            "pre_pad": 0,
+            "weights_path": str(tmp_path / "RealESRGAN_x4plus.pth"),
+        },
+    )
+
+
+def test_keys_change_with_weights(tmp_path):
+    spec = make_spec(tmp_path)
+    weights = tmp_path / "RealESRGAN_x4plus.pth"
+    weights.write_bytes(b"old")
+    tile = torch.rand(1, 3, 16, 16)
+
+    fp32 = weights_fingerprint(spec, "fp32")
+    assert spec.artifact_tag in fp32
+    key = tile_key(spec.name, "fp32", "torch", fp32, tile)
+    assert key == tile_key(spec.name, "fp32", "torch", fp32, tile.clone())
+
+    weights.write_bytes(b"new weights")
+    os.utime(weights, ns=(0, 10**9))
+    changed = weights_fingerprint(spec, "fp32")
+    assert changed != fp32
+    assert tile_key(spec.name, "fp32", "torch", changed, tile) != key
+
+    # dynamic int8, then static int8 after calibration
+    dynamic = weights_fingerprint(spec, "int8")
+    open(quantized_weights_file(spec), "wb").close()
+    assert weights_fingerprint(spec, "int8") != dynamic
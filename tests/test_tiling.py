@@ -0,0 +1,63 @@
+import pytest
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from src.models.tiling import align, plan_tiles, window_sides
+
+
+class Downsampling(nn.Module):
+    """Two stride-2 convolutions and nearest upsampling, pads input to 4 as SCUNet"""
+
+    multiple = 4
+
+    def __init__(self):
+        super().__init__()
+        self.down1 = nn.Conv2d(3, 8, 3, 2, 1)
+        self.down2 = nn.Conv2d(8, 8, 3, 2, 1)
+        self.tail = nn.Conv2d(8, 3, 3, 1, 1)
+
+    def forward(self, x):
+        h, w = x.shape[-2:]
+        x = F.pad(x, (0, -w % self.multiple, 0, -h % self.multiple), "replicate")
+        x = F.relu(self.down2(F.relu(self.down1(x))))
+        x = self.tail(F.interpolate(x, scale_factor=self.multiple, mode="nearest"))
+        return x[..., :h, :w]
+
+
+def test_align_keeps_phase():
+    assert align(21, 48, 90, 4) == (20, 52)
+    assert align(0, 30, 90, 8) == (0, 32)
+    # window at the image border keeps the remainder
+    assert align(61, 29, 90, 4) == (60, 30)
+    assert align(0, 6, 6, 4) == (0, 6)
+
+
+@pytest.mark.parametrize("uniform", [False, True])
+def test_tiled_output_matches_untiled(uniform):
+    torch.manual_seed(0)
+    model = Downsampling().eval()
+    img = torch.rand(1, 3, 70, 90)
+    with torch.no_grad():
+        reference = model(img)
+
+        output = torch.zeros_like(reference)
+        tiles = plan_tiles(70, 90, 30, 9, uniform=uniform, multiple=model.multiple)
+        for tile in tiles:
+            assert tile.window_top % model.multiple == 0
+            assert tile.window_left % model.multiple == 0
+            window = model(img[(..., *tile.window())])
+            output[(..., *tile.area(1))] = window[(..., *tile.crop(1))]
+
+    assert torch.allclose(output, reference, atol=1e-5)
+
+
+@pytest.mark.parametrize("uniform", [False, True])
+@pytest.mark.parametrize("tile_size, tile_pad, multiple", [(1000, 100, 64), (50, 8, 4)])
+def test_window_sides_cover_inner_windows(tile_size, tile_pad, multiple, uniform):
+    sides = window_sides(tile_size, tile_pad, uniform, multiple)
+    for width in range(tile_size, 12 * tile_size, tile_size // 3 + 1):
+        tiles = plan_tiles(1, width, tile_size, tile_pad, uniform, multiple)
+        for tile in tiles:
+            if tile.window_left + tile.window_width < width:
+                assert tile.window_width in sides
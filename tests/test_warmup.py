@@ -0,0 +1,54 @@
+from src.models import warmup as warmup_module
+from src.models.registry import ModelSpec
+from src.models.warmup import warmup_shapes
+
+
+def test_warmup_shapes_are_aligned_batches():
+    shapes = warmup_shapes(1000, 100, batch_size=4, multiple=64)
+    assert shapes == [
+        (4, 1216, 1216),
+        (4, 1216, 1280),
+        (4, 1280, 1216),
+        (4, 1280, 1280),
+    ]
+    assert warmup_shapes(500, 50) == [
+        (1, 550, 550),
+        (1, 550, 600),
+        (1, 600, 550),
+        (1, 600, 600),
+    ]
+
+
+def test_models_without_weights_are_not_warmed_up(monkeypatch, tmp_path):
+    specs = {
+        name: ModelSpec(
+            name,
+            {
+                "class_path": "src.models.real_esrgan.generator.RRDBNetInference",
+                "task": "upscale",
+                "scale": 4,
+                "tile_size": 64,
+                "tile_pad": 8,
+                "pre_pad": 0,
+                "weights_path": str(tmp_path / f"{name}.pth"),
+            },
+        )
+        for name in ("present", "missing")
+    }
+    (tmp_path / "present.pth").touch()
+    monkeypatch.delenv("WARMUP_MODELS", raising=False)
+    monkeypatch.setattr(warmup_module, "load_registry", lambda: specs)
+    assert warmup_module.get_warmup_models() == ["present"]
+
+
+def test_failed_warmup_is_skipped(monkeypatch):
+    warmed = []
+
+    def warmup_model(model_name):
+        if model_name == "missing":
+            raise FileNotFoundError(model_name)
+        warmed.append(model_name)
+
+    monkeypatch.setattr(warmup_module, "warmup_model", warmup_model)
+    warmup_module.warmup(["missing", "scunet"])
+    assert warmed == ["scunet"]
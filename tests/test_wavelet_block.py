@@ -0,0 +1,47 @@
+import pytest
+import torch
+
+from src.models.mlwnet.wavelet_block import LWN
+from src.models.quantization import convert, prepare_static
+
+
+def lwn_output(block, x, frozen: bool) -> torch.Tensor:
+    LWN.frozen = frozen
+    try:
+        with torch.no_grad():
+            return block(x)
+    finally:
+        LWN.frozen = True
+
+
+@pytest.mark.parametrize(
+    "wavelet, size, attention",
+    [
+        ("haar", (16, 24), {}),
+        ("haar", (15, 21), {}),
+        ("haar", (16, 24), {"use_sa": True, "use_ca": True}),
+        ("haar", (15, 21), {"use_sa": True, "use_ca": True}),
+        ("db2", (16, 24), {}),
+        ("db2", (17, 22), {}),
+    ],
+)
+def test_frozen_forward_matches_learned_filters(wavelet, size, attention):
+    torch.manual_seed(0)
+    block = LWN(8, wavelet=wavelet, initialize=False, **attention).eval()
+    x = torch.rand(2, 8, *size)
+    learned = lwn_output(block, x, frozen=False)
+    frozen = lwn_output(block, x, frozen=True)
+    assert frozen.shape == learned.shape
+    assert torch.allclose(frozen, learned, atol=1e-5)
+
+
+def test_quantized_block_runs():
+    torch.manual_seed(0)
+    block = prepare_static(LWN(8).eval())
+    x = torch.rand(1, 8, 16, 16)
+    with torch.no_grad():
+        block(x)
+    block = convert(block)
+    with torch.no_grad():
+        output = block(x)
+    assert output.shape == x.shape
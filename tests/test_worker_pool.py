@@ -0,0 +1,10 @@
+import torch
+
+from src.models import worker_pool
+
+
+def test_pool_runs_in_process_when_cuda_is_initialized(monkeypatch):
+    monkeypatch.setattr(torch.cuda, "is_initialized", lambda: True)
+    calls = []
+    worker_pool.run_pool(lambda: calls.append(True), 2)
+    assert calls == [True]